@@ -1,14 +1,61 @@
 from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
 from db import db  # ✅ Import the existing MongoDB connection from your project
 
 # Collections
 orders = db["orders"]
 clients = db["clients"]
+products = db["products"]
+payments = db["payments"]
+tax_records = db["tax_records"]
+shared_links = db["shared_links"]
 
-# Create indexes for faster queries
-orders.create_index([("status", ASCENDING), ("date", DESCENDING)])
-orders.create_index([("client_id", ASCENDING)])
+# Create indexes for faster queries (run once on deploy: python add.py)
+# Every index the app relies on lives here; nothing is created at import time.
+orders.create_index("order_id", unique=True, sparse=True)              # human-friendly order code
+orders.create_index([("status", ASCENDING), ("date", DESCENDING)])              # view_orders pending list
+orders.create_index([("client_id", ASCENDING), ("date", DESCENDING)])  # client dashboard / history / profile
+orders.create_index([("client_id", ASCENDING), ("status", ASCENDING), ("date", DESCENDING)])  # latest approved per client
+orders.create_index([("omc", ASCENDING), ("date", ASCENDING)])         # oldest-first OMC S-Tax allocation
+orders.create_index([("bdc_name", ASCENDING), ("status", ASCENDING), ("date", DESCENDING)])  # shared BDC deliveries page
+orders.create_index([("stax_unpaid", ASCENDING), ("date", DESCENDING)])  # tax dashboard unpaid list / bank OMC debts
+orders.create_index([("status", ASCENDING), ("product", ASCENDING), ("date", ASCENDING), ("shareholder", ASCENDING)])  # shareholders tax breakdown
 
 clients.create_index("client_id", unique=True)
 
+# bdc.distinct("name") for the share-link form (DISTINCT_SCAN)
+db["bdc"].create_index("name")
+
+# Case-insensitive product name lookups (query with the same collation)
+products.create_index([("name", ASCENDING)], collation={"locale": "en", "strength": 2})
+
+# Equality lookups on the normalized fields written by migrate.py / the app
+tax_records.create_index([("type_norm", ASCENDING), ("order_oid", ASCENDING)])
+# Covers the per-order S-Tax paid $match + $group $sum (amount read straight off the index)
+tax_records.create_index([("order_oid", ASCENDING), ("type_norm", ASCENDING), ("amount", ASCENDING)])
+# S-Tax dashboard / PDF export: type filter + payment_date sort, then the omc / paid_by / amount filters
+tax_records.create_index([("type_norm", ASCENDING), ("payment_date", DESCENDING), ("omc", ASCENDING),
+                          ("paid_by", ASCENDING), ("amount", ASCENDING)])
+payments.create_index([("status_norm", ASCENDING), ("client_id", ASCENDING), ("order_id", ASCENDING)])
+# Per-order confirmed payments: the $lookup (orders._id -> payments.order_id) and the order_id $in sums
+payments.create_index([("order_id", ASCENDING), ("status_norm", ASCENDING)])
+
+# Shareholders page: per-product manual tax rates (unique so the upsert can't duplicate)
+db["shared_tax"].create_index("product", unique=True)
+
+# Partner share links: looked up by token on every request
+shared_links.create_index("token", unique=True)
+shared_links.create_index("expires_at")
+db["shared_links_audit"].create_index([("token", ASCENDING), ("at", DESCENDING)])
+
+# Indexes no longer queried (S-Tax lists read stax_unpaid instead of the type / rate $or)
+# or redundant with the ones above (client_id is a prefix of (client_id, date);
+# (status_norm, order_id) is served by (order_id, status_norm))
+for coll, name in [(orders, "stax_per_l_1"), (orders, "order_type_1"),
+                   (orders, "client_id_1"), (payments, "status_norm_1_order_id_1")]:
+    try:
+        coll.drop_index(name)
+    except OperationFailure:
+        pass  # already gone
+
 print("✅ Indexes created successfully.")
@@ -1,4 +1,6 @@
 from flask import Flask, redirect, url_for, session  # ✅ Required for logout
+from flask_session import Session
+from db import client as mongo_client
 
 # === Auth/Login ===
 from login import login_bp
@@ -46,6 +48,17 @@ from client.client_payment import client_payment_bp
 app = Flask(__name__)
 app.secret_key = '4b1b26eee81fd7da3be8efd2649c3b07140b511118b11009f243adabd4d61559'  # 🔐 Use env variable in production
 
+# === Server-side sessions ===
+# Session data (e.g. per-token share-link unlocks) lives in MongoDB; the cookie only
+# carries the session id, so it no longer grows with every key a user touches.
+app.config.update(
+    SESSION_TYPE="mongodb",
+    SESSION_MONGODB=mongo_client,
+    SESSION_MONGODB_DB="truetype",
+    SESSION_MONGODB_COLLECT="sessions",   # Flask-Session maintains the expiry TTL index
+)
+Session(app)
+
 # === Blueprint Registration ===
 
 # Auth/Login
@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, current_app
 from db import db
+import stax_cache
+from fastmath import _f, stax_remaining
 from bson import ObjectId
+from pymongo import InsertOne, UpdateOne
 from datetime import datetime
 import calendar
 import re
+import time
 
 bank_profile_bp = Blueprint("bank_profile", __name__, template_folder="templates")
 
@@ -12,40 +16,26 @@ payments_col = db["payments"]          # existing bank receipt/confirmations
 orders_col   = db["orders"]            # to compute S-Tax due per order
 tax_col      = db["tax_records"]       # S-Tax payments live here
 
-# ---- shared helpers ----
-def _f(v, default=0.0):
-    try:
-        if v is None or v == "": return default
-        return float(v)
-    except Exception:
-        return default
+# omc_debts is global across banks, so one cached JSON body serves every bank page
+OMC_DEBTS_TTL = 60  # seconds; cached in stax_cache.omc_debts (cleared by every S-Tax writer)
 
+# ---- shared helpers ----
 def _fmt2(n):  # string with 2dp
     try: return f"{float(n):,.2f}"
     except Exception: return "0.00"
 
-def _stax_per_l(order):
-    for k in ("s_tax", "s-tax"):
-        if k in order and order.get(k) is not None:
-            try:
-                return float(order.get(k))
-            except Exception:
-                pass
-    return 0.0
-
-def _order_due(order):
-    return round(_stax_per_l(order) * _f(order.get("quantity"), 0.0), 2)
-
-def _paid_sum_for_order(oid: ObjectId) -> float:
+def _paid_sums_for_orders(oids) -> dict:
+    """One $group over tax_col for many orders -> {order_oid: paid_total}."""
+    if not oids:
+        return {}
     try:
         pipe = [
-            {"$match": {"order_oid": oid, "type": {"$regex": r"^s[\s_-]*tax$", "$options": "i"}}},
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+            {"$match": {"type_norm": "s_tax", "order_oid": {"$in": list(oids)}}},
+            {"$group": {"_id": "$order_oid", "total": {"$sum": "$amount"}}},
         ]
-        row = next(tax_col.aggregate(pipe), None)
-        return float(row.get("total", 0.0)) if row else 0.0
+        return {r["_id"]: _f(r.get("total")) for r in tax_col.aggregate(pipe)}
     except Exception:
-        return 0.0
+        return {}
 
 # ---- page ----
 @bank_profile_bp.route("/bank-profile/<bank_id>")
@@ -68,28 +58,41 @@ def bank_profile(bank_id):
         except ValueError:
             pass
 
-    payments = list(payments_col.find(query).sort("date", -1))
-    total_received = sum(_f(p.get("amount")) for p in payments)
+    # listing + total in one round trip; rows carry only the fields
+    # partials/bank_profile.html renders
+    facet = next(payments_col.aggregate([
+        {"$match": query},
+        {"$facet": {
+            "rows": [
+                {"$sort": {"date": -1}},
+                {"$project": {"date": 1, "amount": 1, "account_last4": 1, "proof_url": 1}},
+            ],
+            "total": [
+                {"$group": {"_id": None, "total": {"$sum": {
+                    "$convert": {"input": "$amount", "to": "double", "onError": 0, "onNull": 0}
+                }}}},
+            ],
+        }},
+    ]), {})
+    payments = facet.get("rows", [])
+    total_received = _f((facet.get("total") or [{}])[0].get("total"))
 
     # history of S-Tax payments sourced from this bank
-    bank_tax_rows = []
-    for r in tax_col.find(
-        {"source_bank_id": ObjectId(bank_id), "type": {"$regex": r"^s[\s_-]*tax$", "$options": "i"}},
-        {"amount":1, "payment_date":1, "reference":1, "paid_by":1, "omc":1, "order_id":1}
-    ).sort("payment_date", -1):
-        pd = r.get("payment_date")
-        if isinstance(pd, datetime):
-            pd_str = pd.strftime("%Y-%m-%d")
-        else:
-            pd_str = str(pd or "—")
-        bank_tax_rows.append({
-            "amount": _f(r.get("amount")),
-            "payment_date_str": pd_str,
-            "reference": r.get("reference"),
-            "paid_by": r.get("paid_by"),
-            "omc": r.get("omc"),
-            "order_id": r.get("order_id"),
-        })
+    # rows come back template-ready (date string + numeric amount formatted by Mongo)
+    bank_tax_rows = list(tax_col.aggregate([
+        {"$match": {"source_bank_id": ObjectId(bank_id), "type_norm": "s_tax"}},
+        {"$sort": {"payment_date": -1}},
+        {"$project": {
+            "_id": 0,
+            "amount": {"$convert": {"input": "$amount", "to": "double", "onError": 0, "onNull": 0}},
+            "payment_date_str": {"$cond": [
+                {"$eq": [{"$type": "$payment_date"}, "date"]},
+                {"$dateToString": {"format": "%Y-%m-%d", "date": "$payment_date"}},
+                {"$ifNull": [{"$toString": "$payment_date"}, "—"]},   # legacy non-date values
+            ]},
+            "reference": 1, "paid_by": 1, "omc": 1, "order_id": 1,
+        }},
+    ]))
 
     return render_template(
         "partials/bank_profile.html",
@@ -104,33 +107,43 @@ def bank_profile(bank_id):
 # ---- API: OMC debts for this tenant (global across orders) ----
 @bank_profile_bp.route("/bank-profile/<bank_id>/omc-debts", methods=["GET"])
 def omc_debts(bank_id):
+    hit = stax_cache.omc_debts.get("debts")
+    if hit and time.monotonic() - hit[0] < OMC_DEBTS_TTL:
+        return current_app.response_class(hit[1], mimetype="application/json")
     try:
-        # Find S-Tax eligible orders and compute remaining per OMC
-        eligible = list(orders_col.find({
-            "$or": [
-                {"order_type": "s_tax"},
-                {"order_type": "combo"},
-                {"s_tax": {"$gt": 0}},
-                {"s-tax": {"$gt": 0}},
-            ]
-        }, {"_id":1, "omc":1, "quantity":1, "s_tax":1, "s-tax":1, "date":1}))
-
-        omc_map = {}
-        for o in eligible:
-            due = _order_due(o)
-            paid = _paid_sum_for_order(o["_id"])
-            rem  = max(0.0, round(due - paid, 2))
-            if rem <= 0: continue
-            omc = o.get("omc") or "—"
-            slot = omc_map.setdefault(omc, {"outstanding":0.0, "unpaid_orders":0})
-            slot["outstanding"] += rem
-            slot["unpaid_orders"] += 1
-
-        debts = [{"omc": k, "outstanding": round(v["outstanding"],2), "unpaid_orders": v["unpaid_orders"]}
-                 for k,v in omc_map.items()]
-        # sort by outstanding desc
-        debts.sort(key=lambda x: x["outstanding"], reverse=True)
-        return jsonify({"status":"success", "debts": debts})
+        # Unpaid S-Tax orders (stax_unpaid, kept on write) -> remaining per order -> outstanding per OMC
+        pipe = [
+            {"$match": {"stax_unpaid": True}},
+            {"$project": {"omc": 1, "quantity": 1, "stax_per_l": 1}},
+            # paid S-Tax per order (localField/foreignField keeps the order_oid index usable)
+            {"$lookup": {
+                "from": "tax_records",
+                "localField": "_id",
+                "foreignField": "order_oid",
+                "pipeline": [
+                    {"$match": {"type_norm": "s_tax"}},
+                    {"$group": {"_id": None, "paid": {"$sum": "$amount"}}},
+                ],
+                "as": "tax",
+            }},
+            {"$addFields": {
+                "due": {"$round": [{"$multiply": [
+                    {"$ifNull": ["$stax_per_l", 0]},
+                    {"$convert": {"input": "$quantity", "to": "double", "onError": 0, "onNull": 0}},
+                ]}, 2]},
+                "paid": {"$ifNull": [{"$arrayElemAt": ["$tax.paid", 0]}, 0]},
+            }},
+            {"$addFields": {"rem": {"$max": [0, {"$round": [{"$subtract": ["$due", "$paid"]}, 2]}]}}},
+            {"$match": {"rem": {"$gt": 0}}},
+            {"$group": {"_id": "$omc", "outstanding": {"$sum": "$rem"}, "unpaid_orders": {"$sum": 1}}},
+            {"$sort": {"outstanding": -1}},
+        ]
+        debts = [{"omc": d["_id"] or "—", "outstanding": round(_f(d.get("outstanding")), 2),
+                  "unpaid_orders": d.get("unpaid_orders", 0)}
+                 for d in orders_col.aggregate(pipe)]
+        resp = jsonify({"status":"success", "debts": debts})
+        stax_cache.omc_debts["debts"] = (time.monotonic(), resp.get_data())
+        return resp
     except Exception as e:
         return jsonify({"status":"error", "message": str(e)}), 500
 
@@ -159,41 +172,34 @@ def pay_omc_from_bank():
             except ValueError: return jsonify({"status":"error", "message":"Invalid payment date"}), 400
 
         # Gather unpaid orders for this OMC, oldest first
-        orders = list(orders_col.find({
-            "omc": omc,
-            "$or": [
-                {"order_type": "s_tax"},
-                {"order_type": "combo"},
-                {"s_tax": {"$gt": 0}},
-                {"s-tax": {"$gt": 0}},
-            ]
-        }, {"_id":1, "order_id":1, "quantity":1, "s_tax":1, "s-tax":1, "date":1}).sort("date", 1))
+        orders = list(orders_col.find(
+            {"omc": omc, "stax_unpaid": True},
+            {"_id":1, "order_id":1, "quantity":1, "stax_per_l":1, "s_tax":1, "s-tax":1, "date":1}
+        ).sort("date", 1))
 
         # Compute remaining per order; keep only those with outstanding
-        alloc_list = []
-        total_outstanding = 0.0
-        for o in orders:
-            due = _order_due(o)
-            paid = _paid_sum_for_order(o["_id"])
-            rem  = max(0.0, round(due - paid, 2))
-            if rem > 0:
-                alloc_list.append({"order": o, "remaining": rem})
-                total_outstanding += rem
+        paid_by_oid = _paid_sums_for_orders([o["_id"] for o in orders])
+        due_arr, rem_arr = stax_remaining(orders, paid_by_oid)
+        alloc_list = [{"order": o, "due": d, "remaining": r}
+                      for o, d, r in zip(orders, due_arr.tolist(), rem_arr.tolist()) if r > 0]
+        total_outstanding = float(rem_arr.sum())
 
         if total_outstanding <= 0:
             return jsonify({"status":"error", "message":"No outstanding S-Tax for this OMC"}), 400
         if amount > total_outstanding:
             return jsonify({"status":"error", "message": f"Amount exceeds OMC outstanding (GHS {_fmt2(total_outstanding)})"}), 400
 
-        # Allocate oldest-first
+        # Allocate oldest-first (computed in Python, written in two bulk ops)
         left = amount
         created = []
+        tax_ops, order_ops = [], []
         for a in alloc_list:
             if left <= 0: break
             portion = min(left, a["remaining"])
             o = a["order"]
-            tax_col.insert_one({
+            tax_ops.append(InsertOne({
                 "type": "S-Tax",
+                "type_norm": "s_tax",
                 "amount": round(portion, 2),
                 "payment_date": pay_dt,
                 "reference": ref or None,
@@ -203,12 +209,13 @@ def pay_omc_from_bank():
                 "order_oid": o["_id"],
                 "source_bank_id": ObjectId(bank_id),   # <— tag for bank view
                 "submitted_at": datetime.utcnow()
-            })
-            # recompute post-insert
-            new_paid = _paid_sum_for_order(o["_id"])
-            due      = _order_due(o)
-            remaining= max(0.0, round(due - new_paid, 2))
+            }))
+            # track post-insert total locally instead of re-aggregating
+            new_paid = paid_by_oid.get(o["_id"], 0.0) + round(portion, 2)
+            paid_by_oid[o["_id"]] = new_paid
+            remaining= max(0.0, round(a["due"] - new_paid, 2))
             update_doc = {
+                "stax_unpaid": remaining > 0,
                 "s_tax_paid_amount": round(new_paid, 2),
                 "s_tax_paid_at": pay_dt,
                 "s_tax_reference": ref or o.get("s_tax_reference"),
@@ -218,11 +225,20 @@ def pay_omc_from_bank():
                 update_doc.update({"s_tax_payment":"paid", "s-tax-payment":"paid"})
             else:
                 update_doc.update({"s_tax_payment":"partial", "s-tax-payment":"partial"})
-            orders_col.update_one({"_id": o["_id"]}, {"$set": update_doc})
+            order_ops.append(UpdateOne({"_id": o["_id"]}, {"$set": update_doc}))
 
             created.append({"order_id": o.get("order_id"), "applied": round(portion,2), "remaining_after": remaining})
             left = round(left - portion, 2)
 
+        # ledger rows and order flags land together or not at all
+        def _write(s):
+            tax_col.bulk_write(tax_ops, ordered=False, session=s)
+            orders_col.bulk_write(order_ops, ordered=False, session=s)
+
+        with db.client.start_session() as s:
+            s.with_transaction(_write)
+        stax_cache.invalidate()
+
         return jsonify({"status":"success", "allocated": created, "omc": omc, "amount": round(amount,2)})
     except Exception as e:
         return jsonify({"status":"error", "message": str(e)}), 500
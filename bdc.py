@@ -40,9 +40,11 @@ def _compute_current_balance(bdc_id: ObjectId):
     from_account_total = 0.0
     credit_total = 0.0
 
-    for p in bdc_doc.get("payment_details", []):
+    for p in bdc_doc.get("payment_details") or ():
         ptype = (p.get("payment_type") or "").strip().lower()
-        amt = _to_f(p.get("amount"))
+        amt = p.get("amount", 0.0)
+        if type(amt) is not float:  # writers store float; only legacy values need _to_f
+            amt = _to_f(amt)
         if ptype == "from account":
             from_account_total += amt
         elif ptype == "credit":
@@ -1,7 +1,7 @@
 from flask import Blueprint, render_template, session, redirect, url_for, flash
 from bson import ObjectId
 from db import db
-from datetime import datetime
+from fastmath import _f
 
 client_dashboard_bp = Blueprint('client_dashboard', __name__, template_folder='templates')
 
@@ -9,12 +9,6 @@ clients_collection   = db.clients
 orders_collection    = db.orders
 payments_collection  = db.payments
 
-def _f(x, default=0.0):
-    try:
-        return float(x)
-    except (TypeError, ValueError):
-        return default
-
 @client_dashboard_bp.route('/dashboard')
 def dashboard():
     if 'client_id' not in session or 'client_name' not in session:
@@ -33,35 +27,64 @@ def dashboard():
         flash("Client not found. Please contact support.", "danger")
         return redirect(url_for('login.login'))
 
-    # Fetch orders for this client (support both ObjectId and string storage on orders)
-    orders = list(
-        orders_collection.find({"client_id": {"$in": [oid, client_id]}}).sort("date", -1)
+    # Only the 5 most recent orders are shown; (client_id, date) index serves sort + limit
+    recent_orders = list(
+        orders_collection.find(
+            {"client_id": oid},
+            {
+                "order_id": 1, "product": 1, "order_type": 1, "vehicle_number": 1,
+                "quantity": 1, "total_debt": 1, "delivery_status": 1, "tts_status": 1,
+                "npa_status": 1, "delivered_date": 1, "driver_name": 1, "driver_phone": 1,
+                "depot": 1, "region": 1, "due_date": 1, "date": 1
+            }
+        ).sort("date", -1).limit(5)
     )
 
-    # Build list of order ObjectIds for payments lookup
-    order_ids_obj = [o["_id"] for o in orders]
-
-    # ---- Payments: confirmed only, for this client and these orders ----
-    payments_pipe = [
+    # ---- Overall totals: computed in MongoDB over all of this client's orders ----
+    # Payments: confirmed only, joined per order via the (order_id, status_norm) index;
+    # amount is always stored numeric (see migrate.py)
+    totals_pipe = [
+        {"$match": {"client_id": oid}},
+        {"$project": {"total_debt": 1}},
         {
-            "$match": {
-                "status": {"$regex": "^confirmed$", "$options": "i"},
-                "client_id": oid,                     # payments saved with ObjectId client_id
-                "order_id": {"$in": order_ids_obj}    # payments saved with ObjectId order_id
+            "$lookup": {
+                "from": "payments",
+                "localField": "_id",
+                "foreignField": "order_id",
+                "pipeline": [
+                    {"$match": {"status_norm": "confirmed"}},
+                    {"$group": {"_id": None, "paid": {"$sum": "$amount"}}}
+                ],
+                "as": "paid"
             }
         },
         {
-            # Be robust if amount was stored as string in some records
-            "$addFields": {
-                "amount_num": {
-                    "$convert": {"input": "$amount", "to": "double", "onError": 0, "onNull": 0}
-                }
+            "$group": {
+                "_id": None,
+                "total_orders": {"$sum": 1},
+                "total_debt": {"$sum": {"$convert": {"input": "$total_debt", "to": "double", "onError": 0, "onNull": 0}}},
+                "total_paid": {"$sum": {"$ifNull": [{"$first": "$paid.paid"}, 0]}}
+            }
+        }
+    ]
+    totals = next(orders_collection.aggregate(totals_pipe), {})
+
+    total_orders = int(totals.get("total_orders", 0))
+    total_debt   = _f(totals.get("total_debt"))
+    total_paid   = _f(totals.get("total_paid"))
+
+    # ---- Per-order paid figures for the recent rows only ----
+    payments_pipe = [
+        {
+            "$match": {
+                "status_norm": "confirmed",
+                "order_id": {"$in": [o["_id"] for o in recent_orders]}    # payments saved with ObjectId order_id
             }
         },
         {
             "$group": {
                 "_id": "$order_id",
-                "total_paid": {"$sum": "$amount_num"}
+                "total_paid": {"$sum": "$amount"}
             }
         }
     ]
@@ -69,34 +92,17 @@ def dashboard():
     # Map: order_id(ObjectId) -> total_paid
     paid_map = {row["_id"]: _f(row.get("total_paid")) for row in payments_collection.aggregate(payments_pipe)}
 
-    # ---- Compute per-order figures & overall totals ----
-    total_orders = len(orders)
-    total_debt   = 0.0
-    total_paid   = 0.0
-
-    for o in orders:
+    for o in recent_orders:
         # Coerce numeric
         o["total_debt"] = _f(o.get("total_debt"))
-        total_debt += o["total_debt"]
 
         # Amount paid ONLY from payments collection (no embedded/legacy sums)
-        paid_external = _f(paid_map.get(o["_id"]))  # defaults to 0.0 when missing
+        paid_external = paid_map.get(o["_id"], 0.0)  # already float; 0.0 when missing
         o["amount_paid"] = round(paid_external, 2)
         o["amount_left"] = round(o["total_debt"] - o["amount_paid"], 2)
-        total_paid += o["amount_paid"]
-
-        # Normalize Mongo extended JSON dates if present
-        for field in ("date", "due_date", "delivered_date"):
-            v = o.get(field)
-            if isinstance(v, dict) and "$date" in v:
-                try:
-                    ms = int(v["$date"].get("$numberLong", 0))
-                    o[field] = datetime.fromtimestamp(ms / 1000.0)
-                except Exception:
-                    pass
 
     amount_left = round(total_debt - total_paid, 2)
-    latest_order = orders[0] if orders else None
+    latest_order = recent_orders[0] if recent_orders else None
 
     return render_template(
         'client/client_dashboard.html',
@@ -106,5 +112,5 @@ def dashboard():
         total_paid=round(total_paid, 2),     # ✅ only from payments collection
         amount_left=amount_left,
         latest_order=latest_order,
-        recent_orders=orders[:5]             # each has .amount_paid filled (payments-only)
+        recent_orders=recent_orders          # each has .amount_paid filled (payments-only)
     )
@@ -1,9 +1,9 @@
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
 from datetime import datetime
-from bson import ObjectId, Regex
+from bson import ObjectId
 from db import db
-import random, string
-from pymongo.errors import DuplicateKeyError
+import string, time
+from pymongo import ReturnDocument
 
 client_order_bp = Blueprint('client_order', __name__, template_folder='templates')
 
@@ -11,24 +11,55 @@ orders_collection = db["orders"]
 products_collection = db["products"]
 trucks_collection = db["trucks"]
 truck_orders_collection = db["truck_orders"]
+counters_collection = db["counters"]
 
-# Ensure unique human-friendly order_id
-orders_collection.create_index("order_id", unique=True, sparse=True)
+# Unique human-friendly order_id index is created by add.py (run on deploy)
+
+# Case-insensitive exact match on product name (backed by the products.name collation index)
+NAME_COLLATION = {"locale": "en", "strength": 2}
+
+# In-process catalog for the price AJAX endpoint: {name_lower: product doc}
+PRODUCT_CACHE_TTL = 60  # seconds; one gunicorn worker (Procfile), so invalidate_product_cache() reaches every request
+_product_cache = {"ts": 0.0, "by_name": {}}
+
+def _cached_product(name):
+    now = time.monotonic()
+    if now - _product_cache["ts"] > PRODUCT_CACHE_TTL:
+        _product_cache["by_name"] = {
+            (p.get("name") or "").strip().lower(): p
+            for p in products_collection.find({}, {"name": 1, "s_price": 1, "p_price": 1, "s_tax": 1, "p_tax": 1})
+        }
+        _product_cache["ts"] = now
+    return _product_cache["by_name"].get(name.lower())
+
+def invalidate_product_cache():
+    """Call after any write to products so the next lookup reloads."""
+    _product_cache["ts"] = 0.0
 
 def _to_int_qty(q):
     if not q:
         return None
     return int(str(q).replace(",", "").strip())
 
-def _maybe_oid(val):
-    try:
-        return ObjectId(val)
-    except Exception:
-        return val  # fall back to raw string if not a valid ObjectId
+_B36 = string.digits + string.ascii_uppercase
 
 def _generate_order_id():
-    """Return a random 5-char uppercase alphanumeric code."""
-    return ''.join(random.choices(string.ascii_uppercase + string.digits, k=5))
+    """
+    Return the next sequential order code: a 6-char uppercase base36 counter.
+    Legacy codes were random 5-char strings, so the longer width can never
+    collide with them and no insert retry is needed.
+    """
+    doc = counters_collection.find_one_and_update(
+        {"_id": "order"},
+        {"$inc": {"n": 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    n, code = doc["n"], ""
+    while n:
+        n, r = divmod(n, 36)
+        code = _B36[r] + code
+    return code.rjust(6, "0")
 
 @client_order_bp.route('/submit_order', methods=['GET', 'POST'])
 def submit_order():
@@ -54,8 +85,9 @@ def submit_order():
 
         # Snapshot current product prices + taxes into the order
         prod_doc = products_collection.find_one(
-            {"name": Regex(f"^{product}$", "i")},
-            {"s_price": 1, "p_price": 1, "s_tax": 1, "p_tax": 1, "name": 1}
+            {"name": product},
+            {"s_price": 1, "p_price": 1, "s_tax": 1, "p_tax": 1, "name": 1},
+            collation=NAME_COLLATION
         )
         snapshot_s_price = (prod_doc or {}).get("s_price")
         snapshot_p_price = (prod_doc or {}).get("p_price")
@@ -64,7 +96,7 @@ def submit_order():
 
         # Build the base order doc
         base_order = {
-            "client_id": _maybe_oid(session['client_id']),
+            "client_id": ObjectId(session['client_id']),  # always ObjectId (see migrate.py)
             "product": product,
             "vehicle_number": vehicle_number,
             "driver_name": driver_name,
@@ -82,21 +114,17 @@ def submit_order():
         if truck:
             base_order["truck_id"] = truck["_id"]
 
-        # Insert with a unique 5-char order_id; retry on rare collisions
-        while True:
-            code = _generate_order_id()
-            doc = dict(base_order)
-            doc["order_id"] = code
-            try:
-                result = orders_collection.insert_one(doc)
-                order_mongo_id = result.inserted_id
-                break
-            except DuplicateKeyError:
-                continue  # try another code
+        # Counter-based order_id is unique by construction; _id is assigned up
+        # front so the truck_orders entry can reference it in the same transaction
+        code = _generate_order_id()
+        order_mongo_id = ObjectId()
+        base_order["_id"] = order_mongo_id
+        base_order["order_id"] = code
 
         # If truck was selected, create entry in truck_orders for admin approval
+        truck_order = None
         if truck:
-            truck_orders_collection.insert_one({
+            truck_order = {
                 "order_ref": str(order_mongo_id),
                 "order_id": code,
                 "client_id": session['client_id'],
@@ -108,7 +136,16 @@ def submit_order():
                 "region": region,
                 "status": "pending",
                 "created_at": datetime.utcnow()
-            })
+            }
+
+        # Both inserts commit together or not at all
+        def _insert(s):
+            orders_collection.insert_one(base_order, session=s)
+            if truck_order:
+                truck_orders_collection.insert_one(truck_order, session=s)
+
+        with db.client.start_session() as s:
+            s.with_transaction(_insert)
 
         flash(f"Order submitted successfully! Your Order ID is {code}", "success")
         return redirect(url_for('client_order.submit_order'))
@@ -141,9 +178,10 @@ def client_product_price():
     if not name:
         return jsonify({"success": False, "error": "Missing product name"}), 400
 
-    product = products_collection.find_one(
-        {"name": Regex(f"^{name}$", "i")},
-        {"s_price": 1, "p_price": 1, "s_tax": 1, "p_tax": 1}
+    product = _cached_product(name) or products_collection.find_one(
+        {"name": name},
+        {"s_price": 1, "p_price": 1, "s_tax": 1, "p_tax": 1},
+        collation=NAME_COLLATION
     )
     if not product:
         return jsonify({"success": False, "error": "Product not found"}), 404
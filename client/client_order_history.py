@@ -1,19 +1,13 @@
 from flask import Blueprint, render_template, session, redirect, url_for
 from bson import ObjectId
-from datetime import datetime
 from db import db
+from fastmath import _f
 
 client_order_history_bp = Blueprint('client_order_history', __name__)
 orders_col   = db["orders"]
 clients_col  = db["clients"]
 payments_col = db["payments"]
 
-def _f(x, default=0.0):
-    try:
-        return float(x)
-    except (TypeError, ValueError):
-        return default
-
 @client_order_history_bp.route("/order_history")
 def client_order_history():
     client_id = session.get("client_id")
@@ -29,9 +23,9 @@ def client_order_history():
     if not client:
         return redirect(url_for("login.client_login"))
 
-    # ✅ Fetch orders (support client_id stored as ObjectId or string)
+    # ✅ Fetch orders (client_id is stored as ObjectId)
     orders = list(
-        orders_col.find({"client_id": {"$in": [oid, client_id]}})
+        orders_col.find({"client_id": oid})
                   .sort("date", -1)
     )
 
@@ -41,26 +35,18 @@ def client_order_history():
     # If there are no orders, skip aggregation to avoid $in: []
     paid_map = {}
     if order_ids_obj:
+        # (order_id, status_norm) index; amount is always stored numeric (see migrate.py)
         pipeline = [
             {
                 "$match": {
-                    "status": {"$regex": "^confirmed$", "$options": "i"},
-                    "client_id": oid,                     # payments saved with ObjectId client_id
+                    "status_norm": "confirmed",
                     "order_id": {"$in": order_ids_obj}    # payments saved with ObjectId order_id
                 }
             },
-            {
-                # Be robust if amount is sometimes a string
-                "$addFields": {
-                    "amount_num": {
-                        "$convert": {"input": "$amount", "to": "double", "onError": 0, "onNull": 0}
-                    }
-                }
-            },
             {
                 "$group": {
                     "_id": "$order_id",
-                    "total_paid": {"$sum": "$amount_num"}
+                    "total_paid": {"$sum": "$amount"}
                 }
             }
         ]
@@ -70,23 +56,13 @@ def client_order_history():
     # ---- Decorate each order with amount_paid / amount_left (payments-only) ----
     for o in orders:
         total_debt = _f(o.get("total_debt"))
-        paid_external = _f(paid_map.get(o["_id"]))  # defaults to 0.0 if no payments
+        paid_external = paid_map.get(o["_id"], 0.0)  # already float; 0.0 if no payments
         o["amount_paid"] = round(paid_external, 2)
         o["amount_left"] = round(total_debt - o["amount_paid"], 2)
 
-        # Normalize Mongo extended JSON dates if any
-        for field in ("date", "due_date"):
-            v = o.get(field)
-            if isinstance(v, dict) and "$date" in v:
-                try:
-                    ms = int(v["$date"].get("$numberLong", 0))
-                    o[field] = datetime.fromtimestamp(ms / 1000.0)
-                except Exception:
-                    pass
-
     # ✅ Latest approved (if any), compute summary from payments-only values
     latest_approved = next(
-        (o for o in orders if (o.get("status") or "").lower() == "approved"),
+        (o for o in orders if o.get("status") == "approved"),
         None
     )
 
@@ -139,6 +139,7 @@ def client_payment():
             "account_last4": account_last4,
             "proof_url": proof_url,
             "status": "pending",
+            "status_norm": "pending",
             "date": created_at
         }
 
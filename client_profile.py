@@ -1,44 +1,11 @@
 from flask import Blueprint, render_template, session, redirect, url_for
 from bson import ObjectId
 from datetime import datetime
-from db import clients_collection, orders_collection, payments_collection
+from db import clients_collection, orders_collection
+from fastmath import _f
 
 client_profile_bp = Blueprint("client_profile", __name__, template_folder="templates")
 
-def _f(x, default=0.0):
-    try:
-        return float(x)
-    except (TypeError, ValueError):
-        return default
-
-def _parse_dt(v):
-    """Handle Mongo extended JSON and naive datetimes."""
-    if isinstance(v, datetime):
-        return v
-    if isinstance(v, (int, float)):
-        # value already in ms/seconds? Heuristic: treat > 10^12 as ms
-        if v > 10**12:  # ms
-            return datetime.fromtimestamp(v / 1000.0)
-        return datetime.fromtimestamp(v)
-    if isinstance(v, dict) and "$date" in v:
-        d = v["$date"]
-        # could be {"$numberLong":"..."} or int ms
-        if isinstance(d, dict) and "$numberLong" in d:
-            try:
-                return datetime.fromtimestamp(int(d["$numberLong"]) / 1000.0)
-            except Exception:
-                return None
-        try:
-            # sometimes "$date" can be millis directly
-            return datetime.fromtimestamp(int(d) / 1000.0)
-        except Exception:
-            # or ISO string
-            try:
-                return datetime.fromisoformat(d.replace("Z", "+00:00"))
-            except Exception:
-                return None
-    return None
-
 @client_profile_bp.route('/client/<client_id>')
 def client_profile(client_id):
     # ✅ Validate ObjectId
@@ -52,90 +19,101 @@ def client_profile(client_id):
     if not client:
         return "Client not found", 404
 
-    # ✅ Fetch all orders for this client (support both ObjectId and string storage)
-    orders = list(
-        orders_collection.find({"client_id": {"$in": [oid, str(oid)]}})
-                         .sort("date", -1)
-    )
-
-    # ---- Aggregate confirmed payments for these orders (payments-only) ----
-    order_ids_obj = [o["_id"] for o in orders]
-
-    paid_map = {}
-    if order_ids_obj:
-        pipeline = [
-            {
-                "$match": {
-                    "status": {"$regex": "^confirmed$", "$options": "i"},
-                    "client_id": oid,                     # payments use ObjectId client_id
-                    "order_id": {"$in": order_ids_obj}    # payments use ObjectId order_id
-                }
-            },
-            {
-                # robust if amount sometimes stored as string
-                "$addFields": {
-                    "amount_num": {
-                        "$convert": {"input": "$amount", "to": "double", "onError": 0, "onNull": 0}
-                    }
-                }
-            },
-            {
-                "$group": {
-                    "_id": "$order_id",
-                    "total_paid": {"$sum": "$amount_num"}
-                }
+    # ✅ Fetch all orders for this client (client_id / dates normalized on write, see migrate.py)
+    #    with their confirmed payments total joined in the same round-trip
+    #    (payments use ObjectId client_id / order_id; amount stored numeric, see migrate.py)
+    pipeline = [
+        {"$match": {"client_id": oid}},
+        {"$sort": {"date": -1}},
+        # only what the profile page renders (skips embedded payment_details etc.)
+        {
+            "$project": {
+                "date": 1, "due_date": 1, "product": 1, "quantity": 1, "status": 1,
+                "omc": 1, "bdc": 1, "depot": 1, "region": 1, "vehicle_number": 1,
+                "p_bdc_omc": 1, "s_bdc_omc": 1, "p_tax": 1, "s_tax": 1, "tax": 1,
+                "margin": 1, "returns": 1, "returns_total": 1, "total_debt": 1
             }
-        ]
-        paid_map = {row["_id"]: _f(row.get("total_paid")) for row in payments_collection.aggregate(pipeline)}
-
-    # ✅ Decorate each order (dates, margins, returns, paid/left)
-    for o in orders:
-        # Dates
-        o["date"] = _parse_dt(o.get("date"))
-        o["due_date"] = _parse_dt(o.get("due_date"))
-
-        # Ensure numeric base fields
-        p     = _f(o.get("p_bdc_omc"), None)
-        s     = _f(o.get("s_bdc_omc"), None)
-        p_tax = _f(o.get("p_tax"), None)
-        s_tax = _f(o.get("s_tax"), None)
-        q     = _f(o.get("quantity"), 0.0)
-
-        # Derive per-L margins (don’t write to DB here; just decorate for view)
-        margin_price = (s - p) if (s is not None and p is not None) else None
-        margin_tax   = (s_tax - p_tax) if (s_tax is not None and p_tax is not None) else None
-
-        # Expose useful fields for template (if you want to show them)
-        o["margin_price"] = round(margin_price, 2) if margin_price is not None else None
-        o["margin_tax"]   = round(margin_tax, 2) if margin_tax is not None else None
-
-        # Returns total using the new rule:
-        # - If both per-L margins exist: (margin_price + margin_tax) * Q
-        # - Else if only one exists:     that_margin * Q
-        # - Else:                        0
-        per_l_sum = 0.0
-        if margin_price is not None: per_l_sum += margin_price
-        if margin_tax   is not None: per_l_sum += margin_tax
-        returns_total = round(per_l_sum * q, 2) if per_l_sum != 0 else 0.0
-
-        # Keep existing returns if already stored, else use derived
-        if o.get("returns_total") is None and o.get("returns") is None:
-            o["returns_total"] = returns_total
-            o["returns"] = returns_total
-        else:
-            # prefer explicit returns_total if present; otherwise fall back to returns
-            o["returns_total"] = _f(o.get("returns_total"), _f(o.get("returns"), returns_total))
-
-        # Debt (display only, do not change db here)
-        o["total_debt"] = _f(o.get("total_debt"))
-
-        # Payments ONLY from payments collection
-        paid_external = _f(paid_map.get(o["_id"]))  # defaults to 0.0 when missing
-        o["amount_paid"] = round(paid_external, 2)
-        o["amount_left"] = round(o["total_debt"] - o["amount_paid"], 2)
+        },
+        {
+            "$lookup": {
+                "from": "payments",
+                "localField": "_id",
+                "foreignField": "order_id",
+                "pipeline": [
+                    {"$match": {"status_norm": "confirmed", "client_id": oid}},
+                    {"$group": {"_id": None, "total_paid": {"$sum": "$amount"}}}
+                ],
+                "as": "_paid"
+            }
+        },
+        {"$addFields": {"paid_external": {"$ifNull": [{"$first": "$_paid.total_paid"}, 0]}}},
+
+        # ✅ Decorate each order server-side (margins, returns, paid/left); display only, nothing written
+        {
+            "$addFields": {
+                "_p":  {"$convert": {"input": "$p_bdc_omc", "to": "double", "onError": None, "onNull": None}},
+                "_s":  {"$convert": {"input": "$s_bdc_omc", "to": "double", "onError": None, "onNull": None}},
+                "_pt": {"$convert": {"input": "$p_tax", "to": "double", "onError": None, "onNull": None}},
+                "_st": {"$convert": {"input": "$s_tax", "to": "double", "onError": None, "onNull": None}},
+                "_q":  {"$convert": {"input": "$quantity", "to": "double", "onError": 0, "onNull": 0}},
+                "total_debt": {"$convert": {"input": "$total_debt", "to": "double", "onError": 0, "onNull": 0}},
+                "amount_paid": {"$round": [{"$ifNull": ["$paid_external", 0]}, 2]}
+            }
+        },
+        {
+            # per-L margins: $subtract yields null when either side is missing
+            "$addFields": {
+                "_mp": {"$subtract": ["$_s", "$_p"]},
+                "_mt": {"$subtract": ["$_st", "$_pt"]},
+                "amount_left": {"$round": [{"$subtract": ["$total_debt", "$amount_paid"]}, 2]}
+            }
+        },
+        {
+            # Returns total = (sum of available per-L margins) * Q
+            "$addFields": {
+                "margin_price": {"$round": ["$_mp", 2]},
+                "margin_tax": {"$round": ["$_mt", 2]},
+                "_ret": {"$round": [{"$multiply": [{"$add": [{"$ifNull": ["$_mp", 0]}, {"$ifNull": ["$_mt", 0]}]}, "$_q"]}, 2]}
+            }
+        },
+        {
+            # Keep existing returns if already stored, else use derived
+            # (prefer explicit returns_total; otherwise fall back to returns)
+            "$addFields": {
+                "returns_total": {"$ifNull": [
+                    {"$convert": {"input": "$returns_total", "to": "double", "onError": None, "onNull": None}},
+                    {"$convert": {"input": "$returns", "to": "double", "onError": None, "onNull": None}},
+                    "$_ret"
+                ]},
+                "returns": {"$cond": [
+                    {"$and": [{"$eq": [{"$ifNull": ["$returns_total", None]}, None]},
+                              {"$eq": [{"$ifNull": ["$returns", None]}, None]}]},
+                    "$_ret",
+                    "$returns"
+                ]}
+            }
+        },
+        {"$project": {"_paid": 0, "_p": 0, "_s": 0, "_pt": 0, "_st": 0, "_q": 0, "_mp": 0, "_mt": 0, "_ret": 0}}
+    ]
 
-    # ✅ Latest approved order (if any) and summary box values
-    latest_approved = next((x for x in orders if (x.get("status") or "").lower() == "approved"), None)
+    # ✅ Latest approved order (client_id, status, date index); its decorated copy is picked from the list below
+    latest = orders_collection.find_one(
+        {"client_id": oid, "status": "approved"}, {"_id": 1}, sort=[("date", -1)]
+    )
+    latest_id = latest["_id"] if latest else None
+
+    orders = []
+    latest_approved = None
+    for o in orders_collection.aggregate(pipeline):
+        # Dates are BSON Date after migrate.py; anything it couldn't convert renders blank instead of 500ing
+        for k in ("date", "due_date"):
+            if not isinstance(o.get(k), datetime):
+                o[k] = None
+        if o["_id"] == latest_id:
+            latest_approved = o
+        orders.append(o)
+
+    # ✅ Summary box values
     if latest_approved:
         total_paid = _f(latest_approved.get("amount_paid"))
         amount_left = max(_f(latest_approved.get("total_debt")) - total_paid, 0.0)
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, jsonify, session
 from bson import ObjectId
 from db import db
 from datetime import datetime
+import re
 
 clientlist_bp = Blueprint('clientlist', __name__, template_folder='templates')
 
@@ -30,6 +31,7 @@ def load_clients():
     query = {}
 
     if search:
+        search = re.escape(search)
         query["$or"] = [
             {"name": {"$regex": search, "$options": "i"}},
             {"phone": {"$regex": search, "$options": "i"}},
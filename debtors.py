@@ -379,6 +379,7 @@ def clients_lookup():
     term = (request.args.get("q") or "").strip()
     q = {}
     if term:
+        term = re.escape(term)
         q = {"$or": [
             {"name": {"$regex": term, "$options": "i"}},
             {"client_id": {"$regex": term, "$options": "i"}}
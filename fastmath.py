@@ -0,0 +1,48 @@
+import numpy as np
+
+# Shared numeric coercion (_f) plus vectorized S-Tax arithmetic over lists of
+# order docs (one array op per field instead of per-order Python float math).
+
+def _f(v, default=0.0):
+    """Parse to float; None / "" / bad values -> default. Strings like '12,300.50' are accepted."""
+    t = type(v)
+    if t is float:
+        return v
+    if t is int:
+        return float(v)
+    if v is None:
+        return default
+    try:
+        if t is str:
+            v = v.replace(",", "").strip()
+        return float(v)
+    except (TypeError, ValueError):
+        return default
+
+def _column(values, n):
+    return np.fromiter(values, dtype=np.float64, count=n)
+
+def _order_stax_per_l(o):
+    """S-Tax per litre for one order; the single rule behind tax.pay_stax and bank_profile.pay_omc."""
+    v = o.get("stax_per_l")
+    if v is None:  # not migrated yet: fall back to 's_tax' / legacy 's-tax'
+        v = o.get("s_tax") if o.get("s_tax") is not None else o.get("s-tax")
+    return _f(v)
+
+def stax_per_l(orders):
+    """S-Tax per litre for each order (canonical 'stax_per_l', see migrate.py)."""
+    return _column((_order_stax_per_l(o) for o in orders), len(orders))
+
+def stax_due(orders):
+    """Due = S-Tax per L × quantity, rounded to 2dp."""
+    qty = _column((_f(o.get("quantity")) for o in orders), len(orders))
+    return np.round(stax_per_l(orders) * qty, 2)
+
+def stax_remaining(orders, paid_by_oid):
+    """
+    Returns (due, remaining) arrays aligned with `orders`, where
+    remaining = max(0, due - paid) and paid comes from {order _id: total}.
+    """
+    due = stax_due(orders)
+    paid = _column((paid_by_oid.get(o["_id"], 0.0) for o in orders), len(orders))
+    return due, np.maximum(0.0, np.round(due - paid, 2))
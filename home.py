@@ -17,7 +17,7 @@ def _sum_returns_total():
     No fallback computations. If a doc lacks returns_total, it contributes 0.
     """
     pipeline = [
-        {"$match": {"status": {"$regex": "^approved$", "$options": "i"}}},
+        {"$match": {"status": "approved"}},
         {"$addFields": {
             "rt": {
                 "$convert": {"input": "$returns_total", "to": "double", "onError": 0, "onNull": 0}
@@ -42,13 +42,13 @@ def dashboard_home():
     total_clients = clients_collection.estimated_document_count()
     total_orders = orders_collection.estimated_document_count()
     total_approved_orders = orders_collection.count_documents({
-        'status': {'$regex': '^approved$', '$options': 'i'}
+        'status': 'approved'
     })
     approval_rate = round((total_approved_orders / total_orders) * 100, 1) if total_orders else 0
 
     # Confirmed payments total (numeric-safe)
     total_paid_cursor = payments_collection.aggregate([
-        {"$match": {"status": {"$regex": "^confirmed$", "$options": "i"}}},
+        {"$match": {"status_norm": "confirmed"}},
         {"$addFields": {
             "amount_num": {"$convert": {"input": "$amount", "to": "double", "onError": 0, "onNull": 0}}
         }},
@@ -90,7 +90,7 @@ def dashboard_details():
 
         # Total Debt (approved) — numeric-safe
         total_debt_cursor = orders_collection.aggregate([
-            {"$match": {"status": {"$regex": "^approved$", "$options": "i"}}},
+            {"$match": {"status": "approved"}},
             {"$addFields": {
                 "debt_num": {"$convert": {"input": "$total_debt", "to": "double", "onError": 0, "onNull": 0}}
             }},
@@ -100,7 +100,7 @@ def dashboard_details():
 
         # Total Paid (confirmed) — numeric-safe
         total_paid_cursor = payments_collection.aggregate([
-            {"$match": {"status": {"$regex": "^confirmed$", "$options": "i"}}},
+            {"$match": {"status_norm": "confirmed"}},
             {"$addFields": {
                 "amount_num": {"$convert": {"input": "$amount", "to": "double", "onError": 0, "onNull": 0}}
             }},
@@ -140,12 +140,12 @@ def dashboard_details():
         three_days_ago = now - timedelta(days=3)
         orders = list(
             orders_collection.find(
-                {'status': {'$regex': '^approved$', '$options': 'i'}, 'date': {'$gte': three_days_ago}}
+                {'status': 'approved', 'date': {'$gte': three_days_ago}}
             ).sort('date', -1).limit(5)
         )
         payments = list(
             payments_collection.find(
-                {'status': {'$regex': '^confirmed$', '$options': 'i'}, 'date': {'$gte': three_days_ago}}
+                {'status_norm': 'confirmed', 'date': {'$gte': three_days_ago}}
             ).sort('date', -1).limit(5)
         )
         overdues = list(
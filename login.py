@@ -1,3 +1,4 @@
+import re
 from flask import Blueprint, render_template, request, redirect, url_for, session, flash
 from db import users_collection, clients_collection
 from werkzeug.security import check_password_hash
@@ -46,7 +47,7 @@ def login():
 
         # === External Client Login (name + phone) ===
         external = clients_collection.find_one({
-            "name": {"$regex": f"^{username}$", "$options": "i"},
+            "name": {"$regex": f"^{re.escape(username)}$", "$options": "i"},
             "phone": password,
             "status": "external"
         })
@@ -0,0 +1,119 @@
+import re
+from datetime import datetime
+from db import db  # ✅ Import the existing MongoDB connection from your project
+
+# Collections
+orders = db["orders"]
+payments = db["payments"]
+tax_records = db["tax_records"]
+
+# One-off backfills: run once after deploy (python migrate.py). Safe to re-run.
+
+# tax_records.type -> type_norm ("S-Tax", "s tax", "s_tax" ... -> "s_tax")
+for t in tax_records.distinct("type"):
+    if not isinstance(t, str):
+        continue
+    norm = t.strip().lower()
+    norm = "s_tax" if re.fullmatch(r"s[\s_-]*tax", norm) else re.sub(r"[\s_-]+", "_", norm)
+    tax_records.update_many({"type": t}, {"$set": {"type_norm": norm}})
+
+# S-Tax spelling variants ("s tax", "s_tax" ...) -> the canonical "S-Tax" that pay_stax writes
+tax_records.update_many({"type_norm": "s_tax", "type": {"$ne": "S-Tax"}}, {"$set": {"type": "S-Tax"}})
+
+# payments.status -> status_norm ("Confirmed", "CONFIRMED" ... -> "confirmed")
+for s in payments.distinct("status"):
+    if not isinstance(s, str):
+        continue
+    payments.update_many({"status": s}, {"$set": {"status_norm": s.strip().lower()}})
+
+# payments.amount stored as string -> double, so $sum needs no per-doc $convert
+payments.update_many(
+    {"amount": {"$type": "string"}},
+    [{"$set": {"amount": {"$convert": {"input": "$amount", "to": "double", "onError": 0, "onNull": 0}}}}]
+)
+
+# orders.client_id, payments.client_id / payments.order_id stored as hex string -> ObjectId
+HEX_OID = {"$type": "string", "$regex": "^[0-9a-fA-F]{24}$"}
+orders.update_many({"client_id": HEX_OID}, [{"$set": {"client_id": {"$toObjectId": "$client_id"}}}])
+payments.update_many({"client_id": HEX_OID}, [{"$set": {"client_id": {"$toObjectId": "$client_id"}}}])
+payments.update_many({"order_id": HEX_OID}, [{"$set": {"order_id": {"$toObjectId": "$order_id"}}}])
+
+# orders.status mixed case ("Approved", "PENDING") -> lowercase, as update_order writes it
+orders.update_many(
+    {"status": {"$type": "string", "$not": {"$regex": "^[^A-Z]*$"}}},
+    [{"$set": {"status": {"$toLower": "$status"}}}]
+)
+
+# orders.s_tax / legacy 's-tax' -> canonical orders.stax_per_l (double) read by tax.py
+orders.update_many(
+    {"stax_per_l": {"$exists": False}},
+    [{"$set": {"stax_per_l": {"$convert": {
+        "input": {"$ifNull": ["$s_tax", "$s-tax"]}, "to": "double", "onError": 0.0, "onNull": 0.0
+    }}}}]
+)
+
+# orders.stax_unpaid: eligible for S-Tax and remaining (stax_per_l x qty - paid S-Tax) > 0
+orders.aggregate([
+    {"$match": {"$or": [{"order_type": {"$in": ["s_tax", "combo"]}}, {"stax_per_l": {"$gt": 0}}]}},
+    {"$lookup": {
+        "from": "tax_records",
+        "localField": "_id",
+        "foreignField": "order_oid",
+        "pipeline": [{"$match": {"type_norm": "s_tax"}}, {"$group": {"_id": None, "paid": {"$sum": "$amount"}}}],
+        "as": "tax",
+    }},
+    {"$project": {"stax_unpaid": {"$gt": [
+        {"$round": [{"$subtract": [
+            {"$multiply": [
+                {"$ifNull": ["$stax_per_l", 0]},
+                {"$convert": {"input": "$quantity", "to": "double", "onError": 0, "onNull": 0}},
+            ]},
+            {"$ifNull": [{"$arrayElemAt": ["$tax.paid", 0]}, 0]},
+        ]}, 2]},
+        0,
+    ]}}},
+    {"$merge": {"into": "orders", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+])
+orders.update_many({"stax_unpaid": {"$exists": False}}, {"$set": {"stax_unpaid": False}})
+
+# orders dates imported as extended JSON ({"$date": {"$numberLong": "..."}}) -> BSON Date
+def _ext_json_date(v):
+    d = v.get("$date")
+    if isinstance(d, dict):
+        d = d.get("$numberLong")
+    if isinstance(d, str) and not d.isdigit():
+        return datetime.fromisoformat(d.replace("Z", "+00:00"))
+    return datetime.utcfromtimestamp(int(d) / 1000.0)
+
+for field in ("date", "due_date", "delivered_date"):
+    for o in orders.find({field: {"$type": "object"}}, {field: 1}):
+        v = o[field]
+        if "$date" not in v:
+            continue
+        try:
+            orders.update_one({"_id": o["_id"]}, {"$set": {field: _ext_json_date(v)}})
+        except (TypeError, ValueError):
+            print(f"⚠️ Skipped unparseable {field} on order {o['_id']}")
+
+    # ISO strings -> BSON Date (unparseable values are left as-is)
+    orders.update_many(
+        {field: {"$type": "string"}},
+        [{"$set": {field: {"$convert": {"input": f"${field}", "to": "date", "onError": f"${field}"}}}}]
+    )
+    # Epoch numbers -> BSON Date, same rule the old _parse_dt used: > 10^12 is ms, otherwise seconds
+    orders.update_many(
+        {field: {"$type": ["int", "long", "double"]}},
+        [{"$set": {field: {"$toDate": {"$cond": [
+            {"$gt": [f"${field}", 10**12]},
+            {"$toLong": f"${field}"},
+            {"$toLong": {"$multiply": [f"${field}", 1000]}},
+        ]}}}}]
+    )
+
+# tax_records.payment_date stored as 'YYYY-MM-DD' string -> BSON Date (S-Tax trend groups on $month)
+tax_records.update_many(
+    {"payment_date": {"$type": "string"}},
+    [{"$set": {"payment_date": {"$convert": {"input": "$payment_date", "to": "date", "onError": "$payment_date"}}}}]
+)
+
+print("✅ Migrations applied successfully.")
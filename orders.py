@@ -1,7 +1,11 @@
-from flask import Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Blueprint, render_template, stream_template, request, redirect, url_for, session, flash, jsonify
 from bson import ObjectId, errors
 from db import db
+from fastmath import _f
+import stax_cache
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from markupsafe import Markup, escape
 
 orders_bp = Blueprint('orders', __name__, template_folder='templates')
 
@@ -11,19 +15,67 @@ bdc_collection           = db['bdc']
 products_collection      = db['products']   # Products collection
 omc_collection           = db['bd_omc']     # OMCs (with rep_phone)
 s_bdc_payment_collection = db['s_bdc_payment']  # ✅ central payment collection
+tax_records_collection   = db['tax_records']    # S-Tax payments (read for stax_unpaid)
+
+# Small shared pool to overlap independent lookups (PyMongo clients are thread-safe)
+_lookup_pool = ThreadPoolExecutor(max_workers=4)
+
+# Case-insensitive exact match on product name (same collation as the products.name index)
+NAME_COLLATION = {"locale": "en", "strength": 2}
 
 # --------------- helpers ---------------
-def _f(v):
-    """parse float or return None"""
-    try:
-        return float(v)
-    except (TypeError, ValueError):
-        return None
+# order_type -> error when its required S values are missing
+_MODE_REQUIRED_MSG = {
+    "s_bdc": "S-BDC is required for S-BDC type.",
+    "s_tax": "S-Tax is required for S-Tax type.",
+    "combo": "S-BDC and S-Tax are required for Combo type.",
+}
 
 def _nz(v):
     """None -> 0.0 without changing real zeros"""
     return v if v is not None else 0.0
 
+def _stax_paid(oid):
+    """S-Tax already paid on this order (same $match + $group as tax.pay_stax)."""
+    row = next(tax_records_collection.aggregate([
+        {"$match": {"order_oid": oid, "type_norm": "s_tax"}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+    ]), None)
+    return _f(row.get("total")) if row else 0.0
+
+# OMC / BDC <option> lists are identical on every order card; render them once
+# per request and only mark the selected option per order (one str.replace).
+def _omc_options_html(omcs):
+    out = []
+    for o in omcs:
+        name = escape(o.get('name') or '')
+        rep  = escape(o.get('rep_phone') or '')
+        label = f"{name} — {rep}" if rep else name
+        out.append(f'<option value="{name}" data-rep-phone="{rep}">{label}</option>')
+    return "".join(out)
+
+def _bdc_options_html(bdcs):
+    out = []
+    for b in bdcs:
+        name = escape(b.get('name') or '')
+        rep  = escape(b.get('rep_phone') or b.get('phone') or '')
+        label = f"{name} — {rep}" if rep else name
+        out.append(f'<option value="{b["_id"]}" data-bdc-name="{name}" data-rep-phone="{rep}">{label}</option>')
+    return "".join(out)
+
+def _client_name(client_id):
+    try:
+        client = clients_collection.find_one({"_id": ObjectId(client_id)}, {"name": 1})
+    except Exception:
+        return ""
+    return client.get("name", "") if client else ""
+
+def _with_selected(options_html, value):
+    if not value:
+        return Markup(options_html)
+    key = f'<option value="{escape(value)}"'
+    return Markup(options_html.replace(key, key + ' selected', 1))
+
 # --------------- pages ---------------
 @orders_bp.route('/', methods=['GET'])
 def view_orders():
@@ -31,7 +83,27 @@ def view_orders():
         flash("Access denied.", "danger")
         return redirect(url_for('login.login'))
 
-    orders = list(orders_collection.find({'status': 'pending'}).sort('date', -1))
+    # One round-trip: pending orders joined to their client (client_id stored as ObjectId, see migrate.py)
+    # Iterated lazily while the page streams; batchSize keeps getMore round-trips low
+    cursor = orders_collection.aggregate([
+        {'$match': {'status': 'pending'}},
+        {'$sort': {'date': -1}},
+        # only what the orders page renders
+        {'$project': {
+            'client_id': 1, 'date': 1, 'due_date': 1, 'product': 1, 'quantity': 1, 'order_type': 1,
+            'omc': 1, 'bdc_id': 1, 'depot': 1, 'region': 1, 'shareholder': 1, 'total_debt': 1,
+            'p_bdc_omc': 1, 's_bdc_omc': 1, 'p_tax': 1, 's_tax': 1,
+            'vehicle_number': 1, 'driver_name': 1, 'driver_phone': 1
+        }},
+        {'$lookup': {
+            'from': 'clients',
+            'localField': 'client_id',
+            'foreignField': '_id',
+            'pipeline': [{'$project': {'name': 1, 'image_url': 1, 'client_id': 1}}],
+            'as': 'client'
+        }},
+        {'$unwind': {'path': '$client', 'preserveNullAndEmptyArrays': True}},
+    ], batchSize=200)
 
     # BDCs with contact fields
     bdcs = list(
@@ -41,50 +113,56 @@ def view_orders():
     # OMCs with contact fields
     omcs = list(omc_collection.find({}, {'name': 1, 'rep_phone': 1}).sort('name', 1))
 
-    for order in orders:
-        # client could be stored as ObjectId or string
-        try:
-            client = clients_collection.find_one({'_id': ObjectId(order.get('client_id'))})
-        except Exception:
-            client = None
-
-        if client:
-            order['client_name'] = client.get('name', 'No Name')
-            order['client_image_url'] = client.get('image_url', '')
-            order['client_id'] = client.get('client_id', '')
-            order['client_profile_url'] = None
-        else:
-            order['client_name'] = 'Unknown'
-            order['client_image_url'] = ''
-            order['client_profile_url'] = None
-
-        # Server-side initial display (fallbacks)
-        p     = _f(order.get('p_bdc_omc'))
-        s     = _f(order.get('s_bdc_omc'))
-        p_tax = _f(order.get('p_tax'))
-        s_tax = _f(order.get('s_tax'))
-        q     = _f(order.get('quantity')) or 0.0
-
-        # per-L margins (only if both sides available)
-        margin_price = (s - p) if (s is not None and p is not None) else None
-        margin_tax   = (s_tax - p_tax) if (s_tax is not None and p_tax is not None) else None
-
-        # expose both margins for the UI
-        order['margin']      = round(margin_price, 2) if margin_price is not None else None
-        order['margin_tax']  = round(margin_tax, 2)   if margin_tax   is not None else None
-
-        # returns = Q × (sum of available margins)
-        ret_price = (_nz(margin_price)) * q
-        ret_tax   = (_nz(margin_tax)) * q
-        ret_total = ret_price + ret_tax
-
-        # store per-part + total for initial render
-        order['returns_sbdc']  = round(ret_price, 2)   # price-margin × Q
-        order['returns_stax']  = round(ret_tax, 2)     # tax-margin × Q
-        order['returns_total'] = round(ret_total, 2)
-        order['returns']       = round(ret_total, 2)   # legacy alias
-
-    return render_template('partials/orders.html', orders=orders, bdcs=bdcs, omcs=omcs)
+    omc_options = _omc_options_html(omcs)
+    bdc_options = _bdc_options_html(bdcs)
+
+    def _decorated():
+        for order in cursor:
+            client = order.pop('client', None)
+
+            order['omc_options'] = _with_selected(omc_options, order.get('omc'))
+            order['bdc_options'] = _with_selected(bdc_options, str(order.get('bdc_id') or ''))
+
+            if client:
+                order['client_name'] = client.get('name', 'No Name')
+                order['client_image_url'] = client.get('image_url', '')
+                order['client_id'] = client.get('client_id', '')
+                order['client_profile_url'] = None
+            else:
+                order['client_name'] = 'Unknown'
+                order['client_image_url'] = ''
+                order['client_profile_url'] = None
+
+            # Server-side initial display (fallbacks)
+            p     = _f(order.get('p_bdc_omc'), None)
+            s     = _f(order.get('s_bdc_omc'), None)
+            p_tax = _f(order.get('p_tax'), None)
+            s_tax = _f(order.get('s_tax'), None)
+            q     = _f(order.get('quantity'))
+
+            # per-L margins (only if both sides available)
+            margin_price = (s - p) if (s is not None and p is not None) else None
+            margin_tax   = (s_tax - p_tax) if (s_tax is not None and p_tax is not None) else None
+
+            # expose both margins for the UI
+            order['margin']      = round(margin_price, 2) if margin_price is not None else None
+            order['margin_tax']  = round(margin_tax, 2)   if margin_tax   is not None else None
+
+            # returns = Q × (sum of available margins)
+            ret_price = (_nz(margin_price)) * q
+            ret_tax   = (_nz(margin_tax)) * q
+            ret_total = ret_price + ret_tax
+
+            # store per-part + total for initial render
+            order['returns_sbdc']  = round(ret_price, 2)   # price-margin × Q
+            order['returns_stax']  = round(ret_tax, 2)     # tax-margin × Q
+            order['returns_total'] = round(ret_total, 2)
+            order['returns']       = round(ret_total, 2)   # legacy alias
+
+            yield order
+
+    # Rows are decorated and rendered one at a time instead of materializing every order
+    return stream_template('partials/orders.html', orders=_decorated(), bdcs=bdcs, omcs=omcs)
 
 @orders_bp.route('/update/<order_id>', methods=['POST'])
 def update_order(order_id):
@@ -114,57 +192,49 @@ def update_order(order_id):
     if mode != "s_tax" and not fields["bdc"]:
         return jsonify({"success": False, "error": "BDC is required for this order type."}), 400
 
-    # Fetch order + client
-    try:
-        order = orders_collection.find_one({"_id": ObjectId(order_id)})
-    except Exception:
-        order = None
+    # Fetch order (parse the id once; reused for every write below)
+    if not ObjectId.is_valid(order_id):
+        return jsonify({"success": False, "error": "Order not found"}), 404
+    oid = ObjectId(order_id)
+    order = orders_collection.find_one({"_id": oid})
     if not order:
         return jsonify({"success": False, "error": "Order not found"}), 404
 
-    client_name = ""
-    try:
-        client = clients_collection.find_one({"_id": ObjectId(order.get("client_id"))})
-        client_name = client.get("name", "") if client else ""
-    except Exception:
-        client = None
-
     # Parse numeric inputs
-    p     = _f(fields["p_bdc_omc"])   # P-BDC
-    s     = _f(fields["s_bdc_omc"])   # S-BDC
-    p_tax = _f(fields["p_tax"])       # P-Tax
-    s_tax = _f(fields["s_tax"])       # S-Tax
+    p     = _f(fields["p_bdc_omc"], None)   # P-BDC (None when blank)
+    s     = _f(fields["s_bdc_omc"], None)   # S-BDC
+    p_tax = _f(fields["p_tax"], None)       # P-Tax
+    s_tax = _f(fields["s_tax"], None)       # S-Tax
 
     # Quantity from the order
-    q = _f(order.get("quantity")) or 0.0
+    q = _f(order.get("quantity"))
 
     # Validate based on order type
-    if mode not in ("s_bdc", "s_tax", "combo"):
+    if mode not in _MODE_REQUIRED_MSG:
         return jsonify({"success": False, "error": "Invalid order type."}), 400
-    if mode == "s_bdc" and s is None:
-        return jsonify({"success": False, "error": "S-BDC is required for S-BDC type."}), 400
-    if mode == "s_tax" and s_tax is None:
-        return jsonify({"success": False, "error": "S-Tax is required for S-Tax type."}), 400
-    if mode == "combo" and (s is None or s_tax is None):
-        return jsonify({"success": False, "error": "S-BDC and S-Tax are required for Combo type."}), 400
+    missing = {"s_bdc": s is None, "s_tax": s_tax is None, "combo": s is None or s_tax is None}
+    if missing[mode]:
+        return jsonify({"success": False, "error": _MODE_REQUIRED_MSG[mode]}), 400
 
     # ---- per-L margins ----
     margin_price = (s - p) if (s is not None and p is not None) else None
     margin_tax   = (s_tax - p_tax) if (s_tax is not None and p_tax is not None) else None
 
     # ---- total debt by order type ----
-    if mode == "s_bdc":
-        total_debt = _nz(s) * q
-    elif mode == "s_tax":
-        total_debt = _nz(s_tax) * q
-    else:  # combo
-        total_debt = (_nz(s) + _nz(s_tax)) * q
+    s_nz, s_tax_nz = _nz(s), _nz(s_tax)
+    debt_per_l = {"s_bdc": s_nz, "s_tax": s_tax_nz, "combo": s_nz + s_tax_nz}
+    total_debt = debt_per_l[mode] * q
 
     # ---- RETURNS: use MARGINS, not S values ----
     returns_price = _nz(margin_price) * q
     returns_tax   = _nz(margin_tax) * q
     returns_total = returns_price + returns_tax
 
+    # ---- S-Tax still owed? same rule as pay_stax: stax_per_l × qty minus S-Tax already paid ----
+    stax_due = round(s_tax_nz * q, 2)
+    stax_unpaid = (mode in ("s_tax", "combo") or s_tax_nz > 0) and stax_due > 0 \
+        and round(stax_due - _stax_paid(oid), 2) > 0
+
     # Build update doc
     update_data = {
         "omc": fields["omc"],
@@ -174,6 +244,8 @@ def update_order(order_id):
         "s_bdc_omc": s,
         "p_tax": p_tax,
         "s_tax": s_tax,
+        "stax_per_l": _nz(s_tax),  # canonical S-Tax per L read by tax.py (s_tax / legacy 's-tax')
+        "stax_unpaid": stax_unpaid,  # S-Tax dashboard / bank OMC debts list; pay_stax / pay_omc keep it current
         "order_type": mode,
         "total_debt": round(total_debt, 2),
         "returns_sbdc": round(returns_price, 2),
@@ -196,6 +268,14 @@ def update_order(order_id):
     else:
         update_data["due_date"] = None
 
+    # Payment (ONLY -> s_bdc_payment) is recorded for these types; its client name
+    # lookup runs alongside the BDC lookup below
+    payment_type_norm = (fields["payment_type"] or "").strip().lower()
+    wants_payment = mode != "s_tax" and payment_type_norm in ("cash", "from account", "credit")
+    if wants_payment and p is None:
+        return jsonify({"success": False, "error": "P-BDC is required to compute payment amount"}), 400
+    client_name_future = _lookup_pool.submit(_client_name, order.get("client_id")) if wants_payment else None
+
     # BDC lookup & set only when not S-Tax (still validate & capture names for UI)
     bdc_id = None
     if mode != "s_tax":
@@ -204,7 +284,7 @@ def update_order(order_id):
         except (ValueError, errors.InvalidId):
             return jsonify({"success": False, "error": "Invalid BDC ID"}), 400
 
-        bdc = bdc_collection.find_one({"_id": bdc_id})
+        bdc = bdc_collection.find_one({"_id": bdc_id}, {"name": 1})
         if not bdc:
             return jsonify({"success": False, "error": "BDC not found"}), 404
 
@@ -214,16 +294,14 @@ def update_order(order_id):
     # ---------------------------
     # Payment handling (ONLY -> s_bdc_payment)
     # ---------------------------
-    payment_type_norm = (fields["payment_type"] or "").strip().lower()
-
-    if mode != "s_tax" and payment_type_norm in ("cash", "from account", "credit"):
-        if p is None:
-            return jsonify({"success": False, "error": "P-BDC is required to compute payment amount"}), 400
+    payment_entry = None
+    if wants_payment:
         calc_amount = round(q * p, 2)
+        client_name = client_name_future.result()
 
         # EXACT schema as BDC.payment_details items
         payment_entry = {
-            "order_id": ObjectId(order_id),
+            "order_id": oid,
             "payment_type": fields["payment_type"],  # original case
             "amount": calc_amount,
             "client_name": client_name or "—",
@@ -238,9 +316,6 @@ def update_order(order_id):
             "date": datetime.utcnow()
         }
 
-        # ✅ Write ONLY to central collection
-        s_bdc_payment_collection.insert_one(payment_entry)
-
     # Status
     complete_fields = (update_data.get("total_debt") is not None) and (
         (mode == "s_tax" and ("returns_total" in update_data or "margin_tax" in update_data)) or
@@ -249,7 +324,22 @@ def update_order(order_id):
     update_data["status"] = "approved" if complete_fields else "pending"
     update_data["delivery_status"] = "pending"
 
-    orders_collection.update_one({"_id": ObjectId(order_id)}, {"$set": update_data})
+    # Normalize legacy string client_id so reads can match on ObjectId only
+    cid = order.get("client_id")
+    if isinstance(cid, str) and ObjectId.is_valid(cid):
+        update_data["client_id"] = ObjectId(cid)
+
+    if payment_entry:
+        # ✅ Payment (central collection ONLY) and order update commit together
+        def _write(s):
+            s_bdc_payment_collection.insert_one(payment_entry, session=s)
+            orders_collection.update_one({"_id": oid}, {"$set": update_data}, session=s)
+
+        with db.client.start_session() as s:
+            s.with_transaction(_write)
+    else:
+        orders_collection.update_one({"_id": oid}, {"$set": update_data})
+    stax_cache.invalidate()  # S-Tax rate / quantity may have changed (bank OMC debts, tax dashboard)
 
     # When approved, send invoice_url for client-side redirect
     approved = (update_data["status"] == "approved")
@@ -266,7 +356,12 @@ def update_order(order_id):
 @orders_bp.route('/get_product_price', methods=['GET'])
 def get_product_price():
     product_name = (request.args.get('name', '') or '').strip().lower()
-    product = products_collection.find_one({'name': {'$regex': f'^{product_name}$', '$options': 'i'}})
+    # case-insensitive exact match served by the products.name collation index (add.py)
+    product = products_collection.find_one(
+        {'name': product_name},
+        {'p_price': 1, 's_price': 1},
+        collation=NAME_COLLATION
+    )
     if not product:
         return jsonify({'success': False, 'error': 'Product not found'}), 404
     return jsonify({
@@ -278,11 +373,10 @@ def get_product_price():
 # --------------- invoice page ---------------
 @orders_bp.route('/invoice/<order_id>', methods=['GET'])
 def order_invoice(order_id):
-    try:
-        oid = ObjectId(order_id)
-    except Exception:
+    if not ObjectId.is_valid(order_id):
         flash("Invalid order id.", "danger")
         return redirect(url_for('orders.view_orders'))
+    oid = ObjectId(order_id)
 
     order = orders_collection.find_one({"_id": oid})
     if not order:
@@ -300,8 +394,8 @@ def order_invoice(order_id):
     # Optional receipt ref if present (kept for compatibility; may be empty now)
     receipt_ref = None
     p_details = (order.get("payment_details") or [])
-    if p_details:
-        latest = sorted(p_details, key=lambda x: x.get("date") or datetime.min, reverse=True)[0]
+    latest = max(p_details, key=lambda x: x.get("date") or datetime.min, default=None)
+    if latest:
         receipt_ref = latest.get("receipt_ref")
 
     return render_template(
@@ -2,6 +2,7 @@ from flask import Blueprint, render_template, request, jsonify
 from bson import ObjectId
 from datetime import datetime
 from db import db
+from client.client_order import invalidate_product_cache
 import re
 
 products_bp = Blueprint("products", __name__, template_folder="templates")
@@ -119,6 +120,7 @@ def add_product():
     }
 
     result = products_collection.insert_one(product)
+    invalidate_product_cache()
     return jsonify({"success": True, "product": {"_id": str(result.inserted_id)}})
 
 # ✏️ Update Product and Append to Price+Tax History
@@ -163,6 +165,7 @@ def update_product(product_id):
             }
         }
     )
+    invalidate_product_cache()
     return jsonify({"success": result.modified_count == 1})
 
 # ❌ Delete Product
@@ -173,6 +176,7 @@ def delete_product(product_id):
     except Exception:
         return jsonify({"success": False, "message": "Invalid product id."}), 400
     result = products_collection.delete_one({"_id": oid})
+    invalidate_product_cache()
     return jsonify({"success": result.deleted_count == 1})
 
 # -------- Clients for sharing (unchanged) --------
@@ -1,9 +1,10 @@
 # share_links.py
-from flask import Blueprint, request, render_template, redirect, url_for, session, jsonify
+from flask import Blueprint, request, render_template, stream_template, redirect, url_for, session, jsonify, g
 from bson import ObjectId
+from pymongo import WriteConcern
 from db import db
-from datetime import datetime, timedelta
-import secrets, re
+from datetime import datetime, timedelta, timezone
+import hmac, os, secrets, time
 from werkzeug.security import generate_password_hash, check_password_hash
 
 shared_bp = Blueprint("shared_links", __name__, template_folder="templates")
@@ -12,6 +13,10 @@ orders = db["orders"]
 clients = db["clients"]
 bdc = db["bdc"]
 shared_links = db["shared_links"]  # NEW collection
+# Unacknowledged handles for audit appends: the response does not wait on them
+shared_links_nowait = shared_links.with_options(write_concern=WriteConcern(w=0))
+# Full append-only audit history, one doc per event (indexed by token, at)
+shared_links_audit = db["shared_links_audit"].with_options(write_concern=WriteConcern(w=0))
 
 STATUS_OPTIONS = [
     "Ordered", "Approved", "GoodStanding", "Depot Manager",
@@ -20,29 +25,163 @@ STATUS_OPTIONS = [
 ]
 
 # ---------- helpers ----------
+@shared_bp.before_request
+def _stamp_request_time():
+    # one timezone-aware UTC timestamp per request, shared by all audit entries / checks
+    g.now = datetime.now(timezone.utc)
+
 def _now():
-    return datetime.utcnow()
+    return g.get("now") or datetime.now(timezone.utc)
+
+def _utc(dt):
+    """Stored datetimes come back naive (UTC) from PyMongo; make them comparable with _now()."""
+    return dt.replace(tzinfo=timezone.utc) if dt.tzinfo is None else dt
 
 def _clean_bdc_name(name: str) -> str:
     return (name or "").strip()
 
 def _require_5_digit(s: str) -> bool:
-    return bool(re.fullmatch(r"\d{5}", s or ""))
+    # ASCII digits only (str.isdigit alone also accepts e.g. superscripts)
+    return bool(s) and len(s) == 5 and s.isascii() and s.isdigit()
+
+# Explicit KDF parameters for share-link passcodes: ~50 ms per hash/verify instead of
+# Werkzeug's default scrypt (~140 ms). Attempts are rate limited server-side, and
+# check_password_hash reads the method from the stored hash, so older links still verify.
+PASSCODE_HASH_METHOD = "pbkdf2:sha256:100000"
+
+# With a server-side pepper (env only, never stored in the DB) the passcode is first
+# keyed with HMAC-SHA256, so a leaked pass_hash can't be brute-forced over the 100k
+# passcode space without the pepper; that lets the KDF itself be much cheaper (~10 ms).
+PASSCODE_PEPPER = os.environ.get("PASSCODE_PEPPER", "").encode()
+PEPPERED_HASH_METHOD = "pbkdf2:sha256:20000"
+
+def _pepper(passcode: str) -> str:
+    return hmac.new(PASSCODE_PEPPER, passcode.encode(), "sha256").hexdigest()
+
+def _passcode_fields(passcode: str) -> dict:
+    """pass_hash (+ whether it was peppered) for a new link doc."""
+    if PASSCODE_PEPPER:
+        return {"pass_hash": generate_password_hash(_pepper(passcode), method=PEPPERED_HASH_METHOD, salt_length=16),
+                "pass_peppered": True}
+    return {"pass_hash": generate_password_hash(passcode, method=PASSCODE_HASH_METHOD, salt_length=16),
+            "pass_peppered": False}
+
+def _check_passcode(link, passcode: str) -> bool:
+    if link.get("pass_peppered"):
+        # peppered hashes can't verify without the pepper
+        return bool(PASSCODE_PEPPER) and check_password_hash(link["pass_hash"], _pepper(passcode))
+    return check_password_hash(link["pass_hash"], passcode)
 
 def _token():
     # url‑safe token
     return secrets.token_urlsafe(24)
 
+# External landing URL prefix per request host (scheme + host + blueprint path),
+# so link creation is a string concat instead of a URL map build each time
+_share_url_base = {}
+
+def _share_url(token):
+    host = request.host_url
+    base = _share_url_base.get(host)
+    if base is None:
+        base = url_for("shared_links.shared_landing", token="__T__", _external=True).rsplit("__T__", 1)[0]
+        if len(_share_url_base) < 16:  # Host header is client-controlled; don't grow unbounded
+            _share_url_base[host] = base
+    return base + token  # token_urlsafe needs no quoting
+
 def _is_link_valid(link_doc):
     if not link_doc:
         return False
     if link_doc.get("revoked_at"):
         return False
     exp = link_doc.get("expires_at")
-    if exp and exp < _now():
+    if exp and _utc(exp) < _now():
         return False
     return True
 
+# Partner routes never read the (growing) audit array; only the landing POST needs pass_hash
+_LINK_FIELDS = {"bdc_name": 1, "revoked_at": 1, "expires_at": 1}
+_LINK_AUTH_FIELDS = {**_LINK_FIELDS, "pass_hash": 1, "pass_peppered": 1}
+AUDIT_KEEP = 50  # newest in-doc audit entries kept per link; full history in shared_links_audit
+
+def _audit(link_id, token, entry, set_fields=None):
+    """Append an audit event: capped copy on the link doc + full record in shared_links_audit."""
+    update = {"$push": {"audit": {"$each": [entry], "$slice": -AUDIT_KEEP}}}
+    if set_fields:
+        update["$set"] = set_fields
+    shared_links_nowait.update_one({"_id": link_id}, update)
+    shared_links_audit.insert_one({"token": token, "link_id": link_id, **entry})
+
+def _find_valid_link(token, projection=None):
+    """Token lookup with the validity predicates in the query: revoked/expired links come back as None."""
+    return shared_links.find_one(
+        {
+            "token": token,
+            "revoked_at": None,
+            "$or": [{"expires_at": None}, {"expires_at": {"$gt": _now()}}]
+        },
+        projection
+    )
+
+UNLOCK_TTL = timedelta(hours=12)  # re-enter the passcode after this (or at link expiry)
+
+def _mark_unlocked(token, link):
+    """
+    Store the unlock expiry (epoch seconds) in the server-side session (Flask-Session,
+    MongoDB "sessions" collection; the cookie only holds the session id), so later
+    partner actions are authorized without re-running the passcode KDF.
+    """
+    until = _now() + UNLOCK_TTL
+    exp = link.get("expires_at")
+    if exp and _utc(exp) < until:
+        until = _utc(exp)
+    session[f"shared_unlocked:{token}"] = until.timestamp()
+
+def _is_unlocked(token):
+    until = session.get(f"shared_unlocked:{token}")
+    # bool(True) from sessions created before expiries were stored is treated as locked
+    if type(until) is not float:
+        return False
+    return until > _now().timestamp()
+
+MAX_PASS_ATTEMPTS = 10
+PASS_ATTEMPT_WINDOW = timedelta(minutes=15)
+
+def _take_pass_attempt(link):
+    """
+    Atomically count one passcode attempt on the link doc. Returns False (no KDF run)
+    once MAX_PASS_ATTEMPTS is reached inside the current window; the window restarts
+    after PASS_ATTEMPT_WINDOW, and a successful unlock resets the counter.
+    """
+    now = _now()
+    window_over = {"$or": [
+        {"$eq": [{"$ifNull": ["$attempts_reset_at", None]}, None]},
+        {"$lte": ["$attempts_reset_at", now]}
+    ]}
+    took = shared_links.find_one_and_update(
+        {"_id": link["_id"], "$or": [
+            {"attempts": {"$not": {"$gte": MAX_PASS_ATTEMPTS}}},
+            {"attempts_reset_at": {"$lte": now}}
+        ]},
+        [{"$set": {
+            "attempts": {"$cond": [window_over, 1, {"$add": [{"$ifNull": ["$attempts", 0]}, 1]}]},
+            "attempts_reset_at": {"$cond": [window_over, now + PASS_ATTEMPT_WINDOW, "$attempts_reset_at"]}
+        }}],
+        projection={"_id": 1}
+    )
+    return took is not None
+
+BDC_NAMES_TTL = 60  # seconds; BDC names change rarely
+_bdc_names_cache = {"ts": 0.0, "names": []}
+
+def _bdc_names():
+    """Sorted distinct BDC names for the form dropdown (server-side distinct, cached)."""
+    now = time.monotonic()
+    if now - _bdc_names_cache["ts"] > BDC_NAMES_TTL:
+        _bdc_names_cache["names"] = sorted(n for n in bdc.distinct("name") if n)
+        _bdc_names_cache["ts"] = now
+    return _bdc_names_cache["names"]
+
 def _safe_oid(val):
     try:
         return ObjectId(val)
@@ -58,8 +197,7 @@ def new_share_link_form():
     """
     if request.method == "GET":
         # Optional: prefill BDC names from your collection to help selection
-        bdc_names = sorted({d.get("name", "") for d in bdc.find({}, {"name": 1}) if d.get("name")})
-        return render_template("shared/new_share_link_form.html", bdc_names=bdc_names, error=None)
+        return render_template("shared/new_share_link_form.html", bdc_names=_bdc_names(), error=None)
 
     # POST -> Create link via same validation as API
     bdc_name = _clean_bdc_name(request.form.get("bdc_name"))
@@ -78,14 +216,13 @@ def new_share_link_form():
         error = "Expiry must be between 1 and 90 days."
 
     if error:
-        bdc_names = sorted({d.get("name", "") for d in bdc.find({}, {"name": 1}) if d.get("name")})
-        return render_template("shared/new_share_link_form.html", bdc_names=bdc_names, error=error)
+        return render_template("shared/new_share_link_form.html", bdc_names=_bdc_names(), error=error)
 
     token = _token()
     doc = {
         "token": token,
         "bdc_name": bdc_name,
-        "pass_hash": generate_password_hash(passcode),
+        **_passcode_fields(passcode),
         "created_at": _now(),
         "expires_at": _now() + timedelta(days=expires_in_days),
         "revoked_at": None,
@@ -93,8 +230,9 @@ def new_share_link_form():
         "audit": [{"type": "create", "at": _now(), "by": session.get("user_id")}]
     }
     shared_links.insert_one(doc)
+    shared_links_audit.insert_one({"token": token, "link_id": doc["_id"], **doc["audit"][0]})
 
-    shared_url = url_for("shared_links.shared_landing", token=token, _external=True)
+    shared_url = _share_url(token)
     return render_template(
         "shared/new_share_link_result.html",
         bdc_name=bdc_name,
@@ -127,7 +265,7 @@ def create_share_link():
     doc = {
         "token": token,
         "bdc_name": bdc_name,
-        "pass_hash": generate_password_hash(passcode),
+        **_passcode_fields(passcode),
         "created_at": _now(),
         "expires_at": _now() + timedelta(days=days),
         "revoked_at": None,
@@ -135,11 +273,12 @@ def create_share_link():
         "audit": [{"type": "create", "at": _now(), "by": session.get("user_id")}]
     }
     shared_links.insert_one(doc)
+    shared_links_audit.insert_one({"token": token, "link_id": doc["_id"], **doc["audit"][0]})
 
     return jsonify({
         "success": True,
-        "url": url_for("shared_links.shared_landing", token=token, _external=True),
-        "expires_at": doc["expires_at"].isoformat() + "Z"
+        "url": _share_url(token),
+        "expires_at": doc["expires_at"].isoformat().replace("+00:00", "Z")
     })
 
 # ---------- Admin: revoke link ----------
@@ -156,36 +295,30 @@ def revoke_share_link(token):
 # ---------- Partner: landing (asks for passcode) ----------
 @shared_bp.route("/deliveries/shared/<token>", methods=["GET", "POST"])
 def shared_landing(token):
-    link = shared_links.find_one({"token": token})
+    link = _find_valid_link(token, _LINK_AUTH_FIELDS)
     if not _is_link_valid(link):
         return render_template("shared/invalid_link.html"), 410  # Gone/invalid
 
-    # Minimal in-session rate limiting for pass attempts
-    key_attempts = f"pass_attempts:{token}"
-    attempts = session.get(key_attempts, 0)
-
     if request.method == "POST":
-        if attempts >= 10:
-            return render_template("shared/passcode.html", token=token, bdc_name=link["bdc_name"],
-                                   error="Too many attempts. Try again later."), 429
-
         passcode = (request.form.get("passcode") or "").strip()
-        session[key_attempts] = attempts + 1
 
         if not _require_5_digit(passcode):
             return render_template("shared/passcode.html", token=token, bdc_name=link["bdc_name"],
                                    error="Enter exactly 5 digits.")
 
-        if not check_password_hash(link["pass_hash"], passcode):
+        # Per-token limit stored on the link (not the cookie), checked before the KDF runs
+        if not _take_pass_attempt(link):
+            return render_template("shared/passcode.html", token=token, bdc_name=link["bdc_name"],
+                                   error="Too many attempts. Try again later."), 429
+
+        if not _check_passcode(link, passcode):
             return render_template("shared/passcode.html", token=token, bdc_name=link["bdc_name"],
                                    error="Incorrect passcode.")
 
         # Success: mark unlocked and set session
-        session[f"shared_unlocked:{token}"] = True
-        shared_links.update_one(
-            {"_id": link["_id"]},
-            {"$push": {"audit": {"type": "unlock", "at": _now(), "ip": request.remote_addr}}}
-        )
+        _mark_unlocked(token, link)
+        _audit(link["_id"], token, {"type": "unlock", "at": _now(), "ip": request.remote_addr},
+               set_fields={"attempts": 0})
         return redirect(url_for("shared_links.shared_manage", token=token))
 
     # GET -> show passcode form
@@ -194,10 +327,10 @@ def shared_landing(token):
 # ---------- Partner: manage deliveries (restricted) ----------
 @shared_bp.route("/deliveries/shared/<token>/manage", methods=["GET"])
 def shared_manage(token):
-    link = shared_links.find_one({"token": token})
+    link = _find_valid_link(token, _LINK_FIELDS)
     if not _is_link_valid(link):
         return render_template("shared/invalid_link.html"), 410
-    if not session.get(f"shared_unlocked:{token}"):
+    if not _is_unlocked(token):
         return redirect(url_for("shared_links.shared_landing", token=token))
 
     bdc_name = link["bdc_name"]
@@ -212,47 +345,32 @@ def shared_manage(token):
         "date": 1, "delivered_date": 1
     }
 
-    items = list(orders.find(filters, projection).sort("date", -1))
-
-    # get client names
-    client_ids = []
-    for o in items:
-        cid = o.get("client_id")
-        if isinstance(cid, ObjectId):
-            client_ids.append(cid)
-        else:
-            try:
-                client_ids.append(ObjectId(str(cid)))
-            except Exception:
-                pass
-
-    cmap = {str(c["_id"]): c.get("name", "Unknown")
-            for c in clients.find({"_id": {"$in": list(set(client_ids))}}, {"name": 1})}
-
-    deliveries = []
-    for o in items:
-        cid = str(o.get("client_id")) if o.get("client_id") else ""
-        deliveries.append({
-            "order_id": str(o["_id"]),
-            "bdc_name": o.get("bdc_name", ""),
-            "client_name": cmap.get(cid, "Unknown"),
-            "product": o.get("product", ""),
-            "vehicle_number": o.get("vehicle_number", ""),
-            "driver_name": o.get("driver_name", ""),
-            "driver_phone": o.get("driver_phone", ""),
-            "quantity": o.get("quantity", 0),
-            "region": o.get("region", ""),
-            "delivery_status": o.get("delivery_status", "pending"),
-            "tts_status": o.get("tts_status"),
-            "npa_status": o.get("npa_status"),
-            "date": o.get("date"),
-            "delivered_date": o.get("delivered_date")
-        })
-
-    return render_template(
+    # One round-trip: $match first so the (bdc_name, status, date) index serves filter + sort,
+    # client names joined server-side (client_id is always ObjectId: written so by submit_order /
+    # update_order, legacy strings converted by migrate.py)
+    cursor = orders.aggregate([
+        {"$match": filters},
+        {"$sort": {"date": -1}},
+        {"$project": projection},
+        {"$lookup": {
+            "from": "clients",
+            "localField": "client_id",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"name": 1}}],
+            "as": "c"
+        }},
+        {"$addFields": {
+            "client_name": {"$ifNull": [{"$arrayElemAt": ["$c.name", 0]}, "Unknown"]},
+            "order_id": {"$toString": "$_id"}     # update form target
+        }},
+        {"$project": {"c": 0}}
+    ], batchSize=500)
+
+    # Rows render as the cursor yields them (stream_template keeps the request context alive)
+    return stream_template(
         "shared/manage_deliveries_shared.html",
         bdc_name=bdc_name,
-        deliveries=deliveries,
+        deliveries=cursor,        # template reads the docs directly (missing fields render blank)
         status_options=STATUS_OPTIONS,
         token=token
     )
@@ -260,10 +378,10 @@ def shared_manage(token):
 # ---------- Partner: update (restricted + server-side BDC check) ----------
 @shared_bp.route("/deliveries/shared/<token>/update_status/<order_id>", methods=["POST"])
 def shared_update_status(token, order_id):
-    link = shared_links.find_one({"token": token})
+    link = _find_valid_link(token, _LINK_FIELDS)
     if not _is_link_valid(link):
         return jsonify({"success": False, "message": "Invalid or expired link."}), 410
-    if not session.get(f"shared_unlocked:{token}"):
+    if not _is_unlocked(token):
         return jsonify({"success": False, "message": "Locked."}), 403
 
     oid = _safe_oid(order_id)
@@ -276,13 +394,6 @@ def shared_update_status(token, order_id):
     if not tts and not npa:
         return jsonify({"success": False, "message": "Provide TTS and/or NPA status."}), 400
 
-    # Ensure the order belongs to the linked BDC
-    order_doc = orders.find_one({"_id": oid}, {"bdc_name": 1})
-    if not order_doc:
-        return jsonify({"success": False, "message": "Order not found."}), 404
-    if order_doc.get("bdc_name") != link["bdc_name"]:
-        return jsonify({"success": False, "message": "Order not allowed for this link."}), 403
-
     update_fields = {}
     if tts:
         update_fields["tts_status"] = tts
@@ -296,16 +407,19 @@ def shared_update_status(token, order_id):
         "timestamp": _now()
     }
 
+    # The filter enforces that the order belongs to the linked BDC
     res = orders.update_one(
-        {"_id": oid},
+        {"_id": oid, "bdc_name": link["bdc_name"]},
         {"$set": update_fields, "$push": {"delivery_history": history_entry}}
     )
+    if res.matched_count == 0:
+        # error path only: tell not-found from not-allowed
+        if not orders.count_documents({"_id": oid}, limit=1):
+            return jsonify({"success": False, "message": "Order not found."}), 404
+        return jsonify({"success": False, "message": "Order not allowed for this link."}), 403
 
-    # audit the share link doc
-    shared_links.update_one(
-        {"_id": link["_id"]},
-        {"$push": {"audit": {"type": "update", "at": _now(), "order_id": str(oid), "ip": request.remote_addr,
-                             "tts": tts or None, "npa": npa or None}}}
-    )
+    # audit the share link doc (fire-and-forget)
+    _audit(link["_id"], token, {"type": "update", "at": _now(), "order_id": str(oid), "ip": request.remote_addr,
+                                "tts": tts or None, "npa": npa or None})
 
     return jsonify({"success": res.modified_count == 1, "message": "Updated" if res.modified_count == 1 else "No change"})
@@ -1,8 +1,14 @@
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, current_app
 from datetime import datetime, timedelta
 from collections import defaultdict
+from functools import lru_cache
+from math import fsum
 from bson import ObjectId
+from pymongo import UpdateOne
 from db import db
+from fastmath import _f
+import msgspec
+import time
 
 shareholders_bp = Blueprint('shareholders', __name__, template_folder='templates')
 
@@ -14,18 +20,16 @@ shared_tax_col = db['shared_tax']  # NEW: where manual tax rates are stored
 # ---------------------
 SHAREHOLDERS = ["Rex", "Simon", "Paul"]
 SHARE_SPLIT = {"Rex": 0.35, "Simon": 0.35, "Paul": 0.30}  # used ONLY for splitting NPA Component
+_SHARE_SPLIT_T = tuple((n, p, int(p * 100)) for n, p in SHARE_SPLIT.items())  # (name, pct, percent int)
 
 # ---------------------
 # Helpers
 # ---------------------
-def _f(v):
-    """Parse to float, handle strings like '12,300.50' and None."""
-    try:
-        if isinstance(v, str):
-            v = v.replace(",", "").strip()
-        return float(v)
-    except Exception:
-        return 0.0
+def _parse_ymd(s):
+    """'YYYY-MM-DD' -> datetime by slicing; anything else goes through strptime. Raises ValueError."""
+    if len(s) == 10 and s[4] == "-" and s[7] == "-" and s[:4].isdigit() and s[5:7].isdigit() and s[8:].isdigit():
+        return datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+    return datetime.strptime(s, "%Y-%m-%d")
 
 
 def _today_utc():
@@ -33,17 +37,36 @@ def _today_utc():
     return datetime(now.year, now.month, now.day)
 
 
-def _order_total_returns(o):
-    """
-    Use new 'total_returns' if present, else 'returns_total', else fallback margin*qty.
-    """
-    if o.get("total_returns") is not None:
-        return _f(o.get("total_returns"))
-    if o.get("returns_total") is not None:
-        return _f(o.get("returns_total"))
-    return round(_f(o.get("margin")) * _f(o.get("quantity")), 2)
-
-
+# ---------------------
+# Server-side parsing / returns (aggregation expressions)
+# ---------------------
+def _num_expr(field):
+    """Like _f: strip thousands separators from strings, anything unparseable -> 0."""
+    return {"$convert": {
+        "input": {"$cond": [
+            {"$eq": [{"$type": field}, "string"]},
+            {"$replaceAll": {"input": {"$trim": {"input": field}}, "find": ",", "replacement": ""}},
+            field
+        ]},
+        "to": "double", "onError": 0.0, "onNull": 0.0
+    }}
+
+# Parse quantity once per order into _q; the $group sums and the returns fallback both read it
+_QTY_STAGE = {"$set": {"_q": _num_expr("$quantity")}}
+
+# Order returns: new 'total_returns' if present, else 'returns_total', else round(margin * qty, 2)
+# (needs _QTY_STAGE earlier in the pipeline)
+_RETURNS_EXPR = {"$let": {
+    "vars": {"r": {"$ifNull": ["$total_returns", "$returns_total", None]}},
+    "in": {"$cond": [
+        {"$eq": ["$$r", None]},
+        {"$round": [{"$multiply": [_num_expr("$margin"), "$_q"]}, 2]},
+        _num_expr("$$r")
+    ]}
+}}
+
+
+@lru_cache(maxsize=256)
 def month_range(ym):
     """'YYYY-MM' -> (start_dt, end_dt_exclusive)"""
     y, m = [int(x) for x in ym.split("-")]
@@ -52,14 +75,22 @@ def month_range(ym):
     return start, end
 
 
+PRODUCTS_TTL = 60  # seconds; the product list changes rarely
+_products_cache = {"ts": 0.0, "val": []}
+
 def distinct_products():
-    prods = orders_col.distinct("product")
-    return sorted([p for p in prods if isinstance(p, str) and p.strip()])
+    """Sorted distinct order products (cached; callers must not mutate the list)."""
+    now = time.monotonic()
+    if now - _products_cache["ts"] > PRODUCTS_TTL:
+        prods = orders_col.distinct("product")
+        _products_cache["val"] = sorted([p for p in prods if isinstance(p, str) and p.strip()])
+        _products_cache["ts"] = now
+    return _products_cache["val"]
 
 # ---------------------
 # Existing summary blocks
 # ---------------------
-def filter_orders_for_returns(period, start_date, end_date):
+def returns_query(period, start_date, end_date):
     now = datetime.utcnow()
     query = {"status": "approved"}
 
@@ -71,29 +102,47 @@ def filter_orders_for_returns(period, start_date, end_date):
         query["date"] = {"$gte": datetime(now.year, now.month, 1)}
     elif period == "custom" and start_date and end_date:
         try:
-            start = datetime.strptime(start_date, "%Y-%m-%d")
-            end = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
+            start = _parse_ymd(start_date)
+            end = _parse_ymd(end_date) + timedelta(days=1)
             query["date"] = {"$gte": start, "$lt": end}
         except ValueError:
             pass
     # else 'all' => no date filter
-    return list(orders_col.find(query))
+    return query
+
+
+# One document per shareholder value (incl. neutral / unset) instead of every order
+CONTRIBUTIONS_GROUP = {"$group": {
+    "_id": "$shareholder",
+    "orders": {"$sum": 1},
+    "quantity": {"$sum": "$_q"},
+    "returns": {"$sum": _RETURNS_EXPR}
+}}
 
 
-def build_contributions(orders):
-    total_orders = len(orders)
-    total_quantity = sum(_f(order.get("quantity")) for order in orders)
-    total_returns = round(sum(_order_total_returns(order) for order in orders), 2)
+def build_contributions(query):
+    return _contributions_from_groups(orders_col.aggregate([{"$match": query}, _QTY_STAGE, CONTRIBUTIONS_GROUP]))
 
+
+def _contributions_from_groups(cursor):
+    # Single pass over the groups: grand totals + per-shareholder rows
+    # ($sum is compensated server-side; fsum keeps the cross-group totals exact for Excel reconciliation)
+    total_orders = 0
+    quantities = []
+    returns_parts = []
     contributions = {name: {"orders": 0, "quantity": 0, "returns": 0.0} for name in SHAREHOLDERS}
-    for order in orders:
-        name = order.get("shareholder")
-        qty = _f(order.get("quantity"))
-        ret = _order_total_returns(order)
+    for g in cursor:
+        total_orders += g["orders"]
+        quantities.append(g["quantity"])
+        returns_parts.append(g["returns"])
+        name = g["_id"]
         if name in contributions:
-            contributions[name]["orders"] += 1
-            contributions[name]["quantity"] += int(round(qty))
-            contributions[name]["returns"] += round(ret, 2)
+            contributions[name]["orders"] = g["orders"]
+            # accumulated unrounded; rounded once here
+            contributions[name]["quantity"] = int(round(g["quantity"]))
+            contributions[name]["returns"] = round(g["returns"], 2)
+    total_quantity = fsum(quantities)
+    total_returns = round(fsum(returns_parts), 2)
 
     for name in SHAREHOLDERS:
         returns = contributions[name]["returns"]
@@ -104,7 +153,7 @@ def build_contributions(orders):
     return total_orders, int(round(total_quantity)), total_returns, contributions, shared_returns
 
 
-def build_volume_data(volume_period, volume_start, volume_end):
+def volume_query(volume_period, volume_start, volume_end):
     now = datetime.utcnow()
     volume_query = {"status": "approved"}
 
@@ -116,34 +165,59 @@ def build_volume_data(volume_period, volume_start, volume_end):
         volume_query["date"] = {"$gte": datetime(now.year, now.month, 1)}
     elif volume_period == "custom" and volume_start and volume_end:
         try:
-            vs = datetime.strptime(volume_start, "%Y-%m-%d")
-            ve = datetime.strptime(volume_end, "%Y-%m-%d") + timedelta(days=1)
+            vs = _parse_ymd(volume_start)
+            ve = _parse_ymd(volume_end) + timedelta(days=1)
             volume_query["date"] = {"$gte": vs, "$lt": ve}
         except ValueError:
             pass
     # else 'all' => no date filter
+    volume_query["shareholder"] = {"$in": SHAREHOLDERS}
+    return volume_query
+
+
+VOLUME_GROUP = {"$group": {"_id": "$shareholder", "qty": {"$sum": "$_q"}}}
 
-    volume_orders = list(orders_col.find(volume_query))
-    volume_data = defaultdict(int)
-    for order in volume_orders:
-        name = order.get("shareholder")
-        qty = int(round(_f(order.get("quantity"))))
-        if name in SHAREHOLDERS:
-            volume_data[name] += qty
 
+def build_volume_data(volume_period, volume_start, volume_end):
+    return _volume_from_groups(orders_col.aggregate([
+        {"$match": volume_query(volume_period, volume_start, volume_end)}, _QTY_STAGE, VOLUME_GROUP
+    ]))
+
+
+def _volume_from_groups(cursor):
+    volume_data = defaultdict(int)
+    for g in cursor:
+        volume_data[g["_id"]] = int(round(g["qty"]))
     return volume_data
 
 # ---------------------
 # Tax storage (NEW: shared_tax collection)
 # ---------------------
+# Only the rate fields are ever read back
+SHARED_TAX_PROJECTION = {"_id": 0, "total_tax": 1, "gra_tax": 1, "npa_life_tax": 1, "npa_component_tax": 1}
+
 def load_shared_tax(product):
     """
     Returns dict with per-L rates if present:
       { total_tax, gra_tax, npa_life_tax, npa_component_tax }
     """
-    doc = shared_tax_col.find_one({"product": product})
+    doc = shared_tax_col.find_one({"product": product}, SHARED_TAX_PROJECTION)
     if not doc:
         return None
+    return _rates_from_doc(doc)
+
+
+def load_shared_taxes(products):
+    """Batch form of load_shared_tax: one $in query -> {product: rates} (missing products omitted)."""
+    if not products:
+        return {}
+    return {
+        doc["product"]: _rates_from_doc(doc)
+        for doc in shared_tax_col.find({"product": {"$in": list(products)}}, {**SHARED_TAX_PROJECTION, "product": 1})
+    }
+
+
+def _rates_from_doc(doc):
     return {
         "total_tax": _f(doc.get("total_tax")),
         "gra_tax": _f(doc.get("gra_tax")),
@@ -158,40 +232,70 @@ def save_shared_tax(product, total_tax, gra_tax, npa_life_tax, npa_component_tax
     """
     shared_tax_col.update_one(
         {"product": product},
-        {"$set": {
-            "product": product,
-            "total_tax": _f(total_tax),
-            "gra_tax": _f(gra_tax),
-            "npa_life_tax": _f(npa_life_tax),
-            "npa_component_tax": _f(npa_component_tax),
-            "updated_at": datetime.utcnow()
-        }},
+        {"$set": _shared_tax_set(product, total_tax, gra_tax, npa_life_tax, npa_component_tax, datetime.utcnow())},
         upsert=True
     )
 
-def derive_rates_for_product(product, start, end):
+
+def save_shared_tax_bulk(rows):
+    """
+    Upsert several products' rates in one round trip.
+    rows: [{product, total_tax, gra_tax, npa_life_tax, npa_component_tax}, ...]
+    """
+    if not rows:
+        return
+    now = datetime.utcnow()
+    shared_tax_col.bulk_write([
+        UpdateOne(
+            {"product": r["product"]},
+            {"$set": _shared_tax_set(r["product"], r["total_tax"], r["gra_tax"],
+                                     r["npa_life_tax"], r["npa_component_tax"], now)},
+            upsert=True
+        )
+        for r in rows
+    ], ordered=False)
+
+
+def _shared_tax_set(product, total_tax, gra_tax, npa_life_tax, npa_component_tax, now):
+    return {
+        "product": product,
+        "total_tax": _f(total_tax),
+        "gra_tax": _f(gra_tax),
+        "npa_life_tax": _f(npa_life_tax),
+        "npa_component_tax": _f(npa_component_tax),
+        "updated_at": now
+    }
+
+def parse_rate_overrides():
     """
-    Final source of truth for rates (per L), with override support via query params:
+    Query param overrides, read once per request:
       ?total_tax_override, ?gra_tax_override, ?npa_life_override, ?npa_component_override
-    Priority:
-      1) Query param overrides (all present)
-      2) shared_tax collection values (manual entries)
-      3) Minimal fallbacks (compute missing pieces if partially provided)
+    Returns (total_tax, gra_tax, npa_life_tax, npa_component_tax) when all are present, else None.
     """
-    # 1) overrides
     qt = request.args.get("total_tax_override")
     qg = request.args.get("gra_tax_override")
     qnl = request.args.get("npa_life_override")
     qnc = request.args.get("npa_component_override")
     if all(x is not None and str(x).strip() != "" for x in [qt, qg, qnl, qnc]):
-        total_tax = _f(qt)
-        gra_tax = _f(qg)
-        npa_life_tax = _f(qnl)
-        npa_component_tax = _f(qnc)
-        return total_tax, gra_tax, npa_life_tax, npa_component_tax
+        return _f(qt), _f(qg), _f(qnl), _f(qnc)
+    return None
+
+
+def derive_rates_for_product(product, overrides, stored_map):
+    """
+    Final source of truth for rates (per L). No Flask / Mongo access:
+    `overrides` comes from parse_rate_overrides(), `stored_map` from load_shared_taxes().
+    Priority:
+      1) Query param overrides (all present)
+      2) shared_tax collection values (manual entries)
+      3) Minimal fallbacks (compute missing pieces if partially provided)
+    """
+    # 1) overrides
+    if overrides is not None:
+        return overrides
 
     # 2) shared_tax storage
-    stored = load_shared_tax(product)
+    stored = stored_map.get(product)
     if stored:
         total_tax = stored.get("total_tax", 0.0)
         gra_tax = stored.get("gra_tax", 0.0)
@@ -224,7 +328,13 @@ def parse_tax_period_args():
     month = (request.args.get("month_tax") or "").strip()
     s = (request.args.get("custom_tax_start") or "").strip()
     e = (request.args.get("custom_tax_end") or "").strip()
+    now = datetime.utcnow()
+    return _tax_period(month, s, e, now.year, now.month)
 
+
+@lru_cache(maxsize=256)
+def _tax_period(month, s, e, year, mon):
+    """Pure part of parse_tax_period_args; (year, mon) is the current month for the default."""
     if month:
         try:
             start, end = month_range(month)
@@ -234,26 +344,30 @@ def parse_tax_period_args():
 
     if s and e:
         try:
-            start = datetime.strptime(s, "%Y-%m-%d")
-            end = datetime.strptime(e, "%Y-%m-%d") + timedelta(days=1)
+            start = _parse_ymd(s)
+            end = _parse_ymd(e) + timedelta(days=1)
             return start, end, "custom", None
         except ValueError:
             pass
 
-    now = datetime.utcnow()
-    start = datetime(now.year, now.month, 1)
-    end = datetime(now.year + (now.month // 12), (now.month % 12) + 1, 1)
-    return start, end, "month", f"{now.year:04d}-{now.month:02d}"
+    start = datetime(year, mon, 1)
+    end = datetime(year + (mon // 12), (mon % 12) + 1, 1)
+    return start, end, "month", f"{year:04d}-{mon:02d}"
 
 
-def parse_selected_products():
+def parse_selected_products(all_products=None):
     """
     Accepts either:
       - multi-select via ?tax_product=ProdA&tax_product=ProdB
       - or comma-separated via ?tax_products=ProdA,ProdB
       - or single ?tax_product=ProdA
       - or 'all' to include all distinct products
+    Pass the caller's distinct_products() result as `all_products` to avoid re-querying.
     """
+    if all_products is None:
+        all_products = distinct_products()
+    if not all_products:
+        return []
     products = request.args.getlist("tax_product")  # multiple allowed
     if not products:
         csv = (request.args.get("tax_products") or "").strip()
@@ -265,49 +379,64 @@ def parse_selected_products():
             products = [single]
 
     if len(products) == 1 and products[0].lower() == "all":
-        products = distinct_products()
+        products = list(all_products)
 
     # Ensure valid & deduped
-    dp = set(distinct_products())
+    dp = set(all_products)
     products = [p for p in products if p in dp]
     if not products and dp:
         products = [sorted(dp)[0]]
     return products
 
 
-def fetch_orders_for_tax(product, start, end):
-    q_base = {"status": "approved", "product": product, "date": {"$gte": start, "$lt": end}}
-    main_q = dict(q_base, **{"shareholder": {"$ne": "neutral"}})
-    neutral_q = dict(q_base, **{"shareholder": "neutral"})
-    main_orders = list(orders_col.find(main_q))
-    neutral_orders = list(orders_col.find(neutral_q))
-    return main_orders, neutral_orders
+def tax_query(products, start, end):
+    # Native datetimes so the (status, product, date, shareholder) index is used
+    # (run as a top-level $match, see summarize_orders_for_tax; not inside a $facet)
+    return {"status": "approved", "product": {"$in": products}, "date": {"$gte": start, "$lt": end}}
 
 
-def summarize_orders_for_tax(orders):
-    total_volume = 0
-    total_returns = 0.0
-    for o in orders:
-        total_volume += int(round(_f(o.get("quantity"))))
-        total_returns += _order_total_returns(o)
-    return total_volume, round(total_returns, 2)
+# Per product, neutral vs everyone else
+TAX_GROUP = {"$group": {
+    "_id": {
+        "product": "$product",
+        "bucket": {"$cond": [{"$eq": ["$shareholder", "neutral"]}, "neutral", "main"]}
+    },
+    "volume": {"$sum": "$_q"},
+    "returns": {"$sum": _RETURNS_EXPR}
+}}
 
 
-def build_tax_breakdown_for_product(product, start, end):
+def summarize_orders_for_tax(products, start, end):
+    """
+    One round trip for all products.
+    Returns {product: {"main": (volume, returns), "neutral": (volume, returns)}}.
     """
-    Returns one product's breakdown as:
+    if not products:
+        return _tax_from_groups(products, [])
+    return _tax_from_groups(products, orders_col.aggregate([
+        {"$match": tax_query(products, start, end)}, _QTY_STAGE, TAX_GROUP
+    ]))
+
+
+def _tax_from_groups(products, cursor):
+    out = {p: {"main": (0, 0.0), "neutral": (0, 0.0)} for p in products}
+    for g in cursor:
+        key = g["_id"]
+        out[key["product"]][key["bucket"]] = (int(round(g["volume"])), round(g["returns"], 2))
+    return out
+
+
+def _compose_breakdown(product, vol_main, vol_neutral, returns_neutral, rates):
+    """
+    Pure arithmetic (no I/O). Returns one product's breakdown as:
       {
         product, volume_main, volume_neutral, neutral_total_returns,
         rates: {...}, rows: [...], split_rows: [...]
       }
-    All per-L rates come from shared_tax (or overrides). Share splits are based on NPA Component only.
+    `rates` is (total_tax, gra_tax, npa_life_tax, npa_component_tax) per L.
+    Share splits are based on NPA Component only.
     """
-    main_orders, neutral_orders = fetch_orders_for_tax(product, start, end)
-    vol_main, _ = summarize_orders_for_tax(main_orders)
-    vol_neutral, returns_neutral = summarize_orders_for_tax(neutral_orders)
-
-    # Final authoritative rates (manual)
-    total_tax, gra_tax, npa_life_tax, npa_component_tax = derive_rates_for_product(product, start, end)
+    total_tax, gra_tax, npa_life_tax, npa_component_tax = rates
 
     # Derive life_component as (NPA/Life - NPA Component), not used for splits but shown for completeness
     life_component_tax = max(npa_life_tax - npa_component_tax, 0.0)
@@ -329,10 +458,10 @@ def build_tax_breakdown_for_product(product, start, end):
 
     # Shareholder split strictly on NPA Component
     split_rows = []
-    for name, pct in SHARE_SPLIT.items():
+    for name, pct, pct_i in _SHARE_SPLIT_T:
         rate = round(npa_component_tax * pct, 4)   # per L
         amount = round(rate * vol_main, 2)         # total for that shareholder
-        split_rows.append({"name": name, "percent": int(pct*100), "rate": rate, "amount": amount})
+        split_rows.append({"name": name, "percent": pct_i, "rate": rate, "amount": amount})
 
     return {
         "product": product,
@@ -351,9 +480,25 @@ def build_tax_breakdown_for_product(product, start, end):
     }
 
 
-def build_tax_breakdown(products, start, end):
-    """Multi-product support. Returns list of product breakdowns."""
-    return [build_tax_breakdown_for_product(p, start, end) for p in products]
+def build_tax_breakdown(products, start, end, overrides=None, summary=None):
+    """
+    Multi-product support. Returns list of product breakdowns.
+    All per-L rates come from shared_tax (or `overrides`, see parse_rate_overrides).
+    Pass a pre-computed `summary` (see _tax_from_groups) to skip the orders query.
+    """
+    if not products:
+        return []
+    if summary is None:
+        summary = summarize_orders_for_tax(products, start, end)
+    shared = load_shared_taxes(products) if overrides is None else {}
+    blocks = []
+    for p in products:
+        vol_main, _ = summary[p]["main"]
+        vol_neutral, returns_neutral = summary[p]["neutral"]
+        # Final authoritative rates (manual)
+        rates = derive_rates_for_product(p, overrides, shared)
+        blocks.append(_compose_breakdown(p, vol_main, vol_neutral, returns_neutral, rates))
+    return blocks
 
 # ✅ Main Route - Handles Everything
 @shareholders_bp.route('/shareholders')
@@ -370,16 +515,27 @@ def view_shareholders():
 
     # ── New: per‑product tax filters
     tax_start, tax_end, tax_period_kind, tax_month_str = parse_tax_period_args()
-    selected_products = parse_selected_products()
     all_products = distinct_products()
+    selected_products = parse_selected_products(all_products)
 
-    # Build existing sections
-    orders = filter_orders_for_returns(period, start_date, end_date)
-    total_orders, total_quantity, total_returns, contributions, shared_returns = build_contributions(orders)
-    volume_data = build_volume_data(volume_period, volume_start, volume_end)
+    # Summary + volume chart in one round trip: each is a $facet branch over the approved orders
+    # (both default to "all" periods, so they read every approved order anyway)
+    facets = {
+        "summary": [{"$match": returns_query(period, start_date, end_date)}, _QTY_STAGE, CONTRIBUTIONS_GROUP],
+        "volume": [{"$match": volume_query(volume_period, volume_start, volume_end)}, _QTY_STAGE, VOLUME_GROUP],
+    }
+    res = next(orders_col.aggregate([{"$match": {"status": "approved"}}, {"$facet": facets}]), {})
 
-    # Build new (multi‑product) tax section
-    tax_breakdowns = build_tax_breakdown(selected_products, tax_start, tax_end)
+    # Build existing sections
+    total_orders, total_quantity, total_returns, contributions, shared_returns = \
+        _contributions_from_groups(res.get("summary", []))
+    volume_data = _volume_from_groups(res.get("volume", []))
+
+    # Build new (multi‑product) tax section: its own aggregate, always month/custom-bounded,
+    # so it stays on the (status, product, date, shareholder) index ($facet branches can't use one)
+    tax_breakdowns = build_tax_breakdown(
+        selected_products, tax_start, tax_end, parse_rate_overrides()
+    )
 
     return render_template(
         "partials/shareholders.html",
@@ -419,8 +575,11 @@ def shareholders_shared_tax_update():
       gra_tax: float (required)
       npa_life_tax: float (required)
       npa_component_tax: float (required)
+    Or JSON {"products": [{...same fields...}, ...]} to save several products at once.
     """
     data = request.get_json(silent=True) or request.form
+    if isinstance(data.get('products'), list):
+        return _shared_tax_update_many(data['products'])
     product = (data.get('product') or '').strip()
     total_tax = data.get('total_tax')
     gra_tax = data.get('gra_tax')
@@ -450,14 +609,36 @@ def shareholders_shared_tax_update():
     except Exception as e:
         return jsonify({"success": False, "error": str(e)}), 500
 
+RATE_FIELDS = ("total_tax", "gra_tax", "npa_life_tax", "npa_component_tax")
+
+def _shared_tax_update_many(items):
+    rows = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            return jsonify({"success": False, "error": f"products[{i}] must be an object"}), 400
+        product = (item.get('product') or '').strip()
+        if not product:
+            return jsonify({"success": False, "error": f"products[{i}]: product is required"}), 400
+        missing = [k for k in RATE_FIELDS if item.get(k) is None]
+        if missing:
+            return jsonify({"success": False, "error": f"products[{i}]: missing fields: {', '.join(missing)}"}), 400
+        rows.append({"product": product, **{k: item[k] for k in RATE_FIELDS}})
+
+    try:
+        save_shared_tax_bulk(rows)
+        saved = {r["product"]: {k: _f(r[k]) for k in RATE_FIELDS} for r in rows}
+        return jsonify({"success": True, "products": list(saved), "saved": saved})
+    except Exception as e:
+        return jsonify({"success": False, "error": str(e)}), 500
+
 # ✅ Debug JSON to compare with Excel numbers
 @shareholders_bp.route("/shareholders/tax_debug.json")
 def shareholders_tax_debug():
     selected_products = parse_selected_products()
     tax_start, tax_end, tax_period_kind, tax_month_str = parse_tax_period_args()
 
-    blocks = build_tax_breakdown(selected_products, tax_start, tax_end)
-    return {
+    blocks = build_tax_breakdown(selected_products, tax_start, tax_end, parse_rate_overrides())
+    payload = {
         "products": selected_products,
         "period_kind": tax_period_kind,
         "month": tax_month_str,
@@ -465,3 +646,5 @@ def shareholders_tax_debug():
         "end_inclusive": (tax_end - timedelta(days=1)).strftime("%Y-%m-%d"),
         "breakdowns": blocks
     }
+    # msgspec encodes the float-heavy blocks in C (much faster than the stdlib json provider)
+    return current_app.response_class(msgspec.json.encode(payload), mimetype="application/json")
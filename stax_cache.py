@@ -0,0 +1,13 @@
+# S-Tax read caches shared by the tax dashboard and the bank profile page (TTLs live with each page).
+# Every S-Tax writer (pay_stax, add_tax, pay_omc_from_bank, update_order) calls invalidate(),
+# so a payment on one page is not hidden by the other page's cached totals.
+# ⚠️ Per process: the Procfile runs ONE gunicorn worker (threads for concurrency) so invalidate() reaches
+# every request. Move these to a shared store before raising -w, or other workers serve stale totals for up to
+# their TTL after a write.
+
+cards_trend = {}  # tax dashboard: "cards_trend" -> (monotonic ts, omc_cards, trend)
+omc_debts = {}    # bank profile:  "debts"       -> (monotonic ts, json bytes)
+
+def invalidate():
+    cards_trend.clear()
+    omc_debts.clear()
@@ -1,26 +1,43 @@
 from flask import Blueprint, render_template, request, jsonify, send_file
 from datetime import datetime, timedelta
+from functools import lru_cache
 from bson import ObjectId, errors
+from pymongo.read_concern import ReadConcern
+from pymongo.read_preferences import SecondaryPreferred
 from io import BytesIO
+from urllib.parse import urlencode
 from db import db
+from fastmath import _f, _order_stax_per_l
+import stax_cache
 import calendar
 import re
 import requests
+import threading
+import time
 
 tax_bp = Blueprint("tax", __name__, template_folder="templates")
 
 orders_col = db["orders"]
 tax_col   = db["tax_records"]
 
-# ---------- helpers ----------
-def _f(v, default=0.0):
-    try:
-        if v is None or v == "":
-            return default
-        return float(v)
-    except (TypeError, ValueError):
-        return default
+# 📖 Secondary-preferred handle for the stale-tolerant reads only: the paid history page and the PDF export.
+# The unpaid list (acted on right after a payment) and the cards/trend cache fill stay on the primary,
+# so a lagging secondary can't show a just-paid order or re-cache pre-payment totals.
+tax_ro = tax_col.with_options(read_preference=SecondaryPreferred(), read_concern=ReadConcern("available"))
+
+UNPAID_ROWS_LIMIT = 500  # newest unpaid orders listed on the dashboard (the total covers all)
+PAID_PAGE_SIZE = 50      # paid table rows per page (?page=N&page_size=M, capped at PAID_PAGE_SIZE_MAX)
+PAID_PAGE_SIZE_MAX = 500
+
+# OMC cards + trend cover ALL S-Tax (no user filters), so one cached copy serves every dashboard hit
+CARDS_TREND_TTL = 60  # seconds; cached in stax_cache.cards_trend (cleared by every S-Tax writer)
 
+# Report logo: fetched once per process (success or failure), shared by every PDF export
+LOGO_URL = "https://res.cloudinary.com/dl2ipzxyk/image/upload/v1751107241/logo_ijmteg.avif"
+_logo_cache = {}  # "logo" -> ImageReader or None
+_logo_lock = threading.Lock()
+
+# ---------- helpers ----------
 def _fmt(n):
     try:
         return f"{float(n):,.2f}"
@@ -36,30 +53,34 @@ def _str_oid(v):
 def _month_buckets():
     return {m: 0.0 for m in list(calendar.month_name)[1:]}
 
-def _stax_per_l(order: dict) -> float:
-    """Get S-Tax per litre from the order (supports 's_tax' and 's-tax')."""
-    for k in ("s_tax", "s-tax"):
-        if k in order and order.get(k) is not None:
-            val = _f(order.get(k), None)
-            if val is not None:
-                return float(val)
-    return 0.0
-
 def _order_stax_due(order: dict) -> float:
-    """Due = S-Tax per L × quantity."""
+    """Due = S-Tax per L × quantity (per-L rule shared with bank_profile via fastmath)."""
     q = _f(order.get("quantity"), 0.0)
-    stax = _stax_per_l(order)
+    stax = _order_stax_per_l(order)
     return round(q * stax, 2)
 
+def _type_norm(t):
+    """Canonical lowercase token stored as tax_records.type_norm ('S-Tax' -> 's_tax')."""
+    t = (t or "").strip().lower()
+    if re.fullmatch(r"s[\s_-]*tax", t):
+        return "s_tax"
+    return re.sub(r"[\s_-]+", "_", t)
+
+# YYYY-MM-DD | YYYY/MM/DD | DD-MM-YYYY in one match
+_DATE_RE = re.compile(r"^(?:(\d{4})([-/])(\d{1,2})\2(\d{1,2})|(\d{1,2})-(\d{1,2})-(\d{4}))$")
+
+@lru_cache(maxsize=256)
 def _parse_date_start(s):
-    if not s:
+    m = _DATE_RE.match(s) if s else None
+    if not m:
+        return None
+    y, _, mo, d, d2, mo2, y2 = m.groups()
+    try:
+        if y:
+            return datetime(int(y), int(mo), int(d))
+        return datetime(int(y2), int(mo2), int(d2))
+    except ValueError:  # e.g. 2024-02-30
         return None
-    for fmt in ("%Y-%m-%d", "%Y/%m/%d", "%d-%m-%Y"):
-        try:
-            return datetime.strptime(s, fmt)
-        except ValueError:
-            continue
-    return None
 
 def _parse_date_end(s):
     """Parse and set to end-of-day so filters include the full 'to' date."""
@@ -68,69 +89,132 @@ def _parse_date_end(s):
         return None
     return dt.replace(hour=23, minute=59, second=59, microsecond=999999)
 
+# s-tax, s_tax, S Tax ... all share type_norm "s_tax" (written on insert, backfilled by migrate.py)
+_PAID_TYPE_QUERY = {"type_norm": "s_tax"}
+
 def _paid_type_query():
-    # robust & index-friendly: match s-tax, s_tax, s tax (any case)
-    return {"type": {"$regex": r"^s[\s_-]*tax$", "$options": "i"}}
+    # shared module constant: callers copy ({**...}) or wrap it, never mutate it
+    return _PAID_TYPE_QUERY
+
+def _logo_reader():
+    """reportlab ImageReader for the report logo, or None (AVIF may fail; ignore if so)."""
+    if "logo" in _logo_cache:
+        return _logo_cache["logo"]
+    with _logo_lock:
+        if "logo" not in _logo_cache:
+            reader = None
+            try:
+                from reportlab.lib.utils import ImageReader
+                resp = requests.get(LOGO_URL, timeout=6)
+                if resp.ok:
+                    reader = ImageReader(BytesIO(resp.content))
+                    reader.getSize()  # decode now so a bad image is cached as None
+            except Exception:
+                reader = None
+            _logo_cache["logo"] = reader
+    return _logo_cache["logo"]
+
+_char_w = {}  # char -> width in Helvetica 9 (filled lazily; reportlab is imported per export)
 
-def _paid_sum_for_order(oid: ObjectId) -> float:
-    """Sum of all S-Tax payments recorded for this order."""
+def _fit_text(txt, maxw, string_width):
+    """
+    Truncate txt with '…' to fit maxw (Helvetica 9). Helvetica has no kerning in reportlab,
+    so widths are additive: one stringWidth for the common fits-as-is case, then a single
+    walk over cached per-char widths to find the cut.
+    """
+    if string_width(txt, "Helvetica", 9) <= maxw:
+        return txt
+    budget = maxw - string_width("…", "Helvetica", 9)
+    acc = 0.0
+    for i, ch in enumerate(txt):
+        w = _char_w.get(ch)
+        if w is None:
+            w = _char_w[ch] = string_width(ch, "Helvetica", 9)
+        acc += w
+        if acc > budget:
+            return txt[:i] + "…"
+    return txt
+
+def _paid_sum_for_order(oid: ObjectId, session=None) -> float:
+    """
+    Sum of all S-Tax payments recorded for this order.
+    Inside a transaction (session given) errors propagate so with_transaction can retry/abort.
+    """
+    pipe = [
+        {"$match": {"order_oid": oid, **_paid_type_query()}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
+    ]
     try:
-        pipe = [
-            {"$match": {"order_oid": oid, **_paid_type_query()}},
-            {"$group": {"_id": None, "total": {"$sum": "$amount"}}},
-        ]
-        row = next(tax_col.aggregate(pipe), None)
-        return float(row.get("total", 0.0)) if row else 0.0
+        row = next(tax_col.aggregate(pipe, session=session), None)
     except Exception:
+        if session is not None:
+            raise
         return 0.0
+    return float(row.get("total", 0.0)) if row else 0.0
 
 # ---------- views ----------
 @tax_bp.route("/tax", methods=["GET"])
 def tax_dashboard():
     # ===== UNPAID (and partially paid) =====
-    # Eligible orders: explicit type 's_tax' OR 'combo' OR has s_tax/s-tax > 0
-    base_query = {
-        "$or": [
-            {"order_type": "s_tax"},
-            {"order_type": "combo"},
-            {"s_tax": {"$gt": 0}},
-            {"s-tax": {"$gt": 0}},
-        ]
-    }
-    projection = {
-        "_id": 1, "order_id": 1, "omc": 1, "quantity": 1,
-        "s_tax": 1, "s-tax": 1,
-        "due_date": 1, "date": 1,
-        # We intentionally ignore legacy s_tax_payment flags here and compute balance
-    }
-    eligible_orders = list(orders_col.find(base_query, projection).sort("date", -1))
-
-    unpaid_rows, total_unpaid_sum = [], 0.0
-    for o in eligible_orders:
-        oid = o.get("_id")
-        due = _order_stax_due(o)  # s_tax × qty
-        already_paid = _paid_sum_for_order(oid)  # sum of all S-Tax payments
-        remaining = max(0.0, round(due - already_paid, 2))
-
+    # Eligible, not fully paid orders (explicit type 's_tax' OR 'combo' OR has stax_per_l > 0).
+    # stax_unpaid is maintained on write (update_order / pay_stax / pay_omc, backfilled by migrate.py);
+    # the remaining > 0 check below stays authoritative.
+    base_query = {"stax_unpaid": True}
+    # due = s_tax × qty, paid = sum of all S-Tax payments, remaining computed server-side;
+    # only the newest UNPAID_ROWS_LIMIT rows come back, the total covers every unpaid order.
+    # We intentionally ignore legacy s_tax_payment flags here and compute balance
+    unpaid = next(orders_col.aggregate([
+        {"$match": base_query},
+        {"$sort": {"date": -1}},
+        {"$project": {
+            "order_id": 1, "omc": 1, "due_date": 1, "date": 1,
+            "stax_per_l": {"$ifNull": ["$stax_per_l", 0]},
+            "qty": {"$convert": {"input": "$quantity", "to": "double", "onError": 0, "onNull": 0}},
+        }},
+        # paid S-Tax per order (localField/foreignField keeps the order_oid index usable)
+        {"$lookup": {
+            "from": "tax_records",
+            "localField": "_id",
+            "foreignField": "order_oid",
+            "pipeline": [
+                {"$match": _paid_type_query()},
+                {"$group": {"_id": None, "paid": {"$sum": "$amount"}}},
+            ],
+            "as": "tax",
+        }},
+        {"$addFields": {
+            "due": {"$round": [{"$multiply": ["$stax_per_l", "$qty"]}, 2]},
+            "paid": {"$ifNull": [{"$arrayElemAt": ["$tax.paid", 0]}, 0]},
+        }},
+        {"$addFields": {"rem": {"$max": [0, {"$round": [{"$subtract": ["$due", "$paid"]}, 2]}]}}},
         # show only those with remaining > 0
-        if remaining > 0:
-            total_unpaid_sum += remaining
-            unpaid_rows.append({
-                "_id": _str_oid(oid),
-                "order_id": o.get("order_id", "—"),
-                "omc": o.get("omc", "—"),
-                "due_amount": remaining,
-                "due_amount_fmt": _fmt(remaining),
-                "payment_status": "Pending" if already_paid == 0 else "Partially Paid",
-                "payment_badge": "warning" if already_paid == 0 else "info",
-                "due_date": o.get("due_date"),
-                "date": o.get("date"),
-                "quantity_fmt": _fmt(_f(o.get("quantity"), 0.0)),
-                # Keep the key name the template expects; now it shows S-Tax per L
-                "s_price_fmt": _fmt(_stax_per_l(o)),
-                # expose already paid for front-end modal
-                "already_paid_fmt": _fmt(already_paid),
-            })
+        {"$match": {"rem": {"$gt": 0}}},
+        {"$project": {"tax": 0}},
+        {"$facet": {
+            "rows": [{"$limit": UNPAID_ROWS_LIMIT}],
+            "total": [{"$group": {"_id": None, "s": {"$sum": "$rem"}}}],
+        }},
+    ]), {})
+
+    fmt = _fmt  # local alias for the row loops below
+    # paid / rem are always numeric here ($ifNull / $max in the pipeline)
+    unpaid_rows = [{
+        "_id": str(o["_id"]),
+        "order_id": o.get("order_id", "—"),
+        "omc": o.get("omc", "—"),
+        "due_amount": o["rem"],
+        "due_amount_fmt": fmt(o["rem"]),
+        "payment_status": "Pending" if o["paid"] == 0 else "Partially Paid",
+        "payment_badge": "warning" if o["paid"] == 0 else "info",
+        "due_date": o.get("due_date"),
+        "date": o.get("date"),
+        "quantity_fmt": fmt(o.get("qty")),
+        # Keep the key name the template expects; now it shows S-Tax per L
+        "s_price_fmt": fmt(o.get("stax_per_l")),
+        # expose already paid for front-end modal
+        "already_paid_fmt": fmt(o["paid"]),
+    } for o in unpaid.get("rows", [])]
+    total_unpaid_sum = _f((unpaid.get("total") or [{}])[0].get("s"), 0.0)
 
     # ===== FILTERS for PAID table =====
     omc_f      = (request.args.get("omc") or "").strip()
@@ -166,62 +250,110 @@ def tax_dashboard():
     except ValueError:
         pass
 
-    # ===== PAID rows (filtered) =====
-    paid_rows, total_paid_sum = [], 0.0
-    for t in tax_col.find(paid_query, {
-        "_id": 0, "type": 1, "amount": 1, "payment_date": 1, "reference": 1,
-        "paid_by": 1, "omc": 1, "order_id": 1, "order_oid": 1
-    }).sort("payment_date", -1):
-        amt = _f(t.get("amount"), 0.0)
-        total_paid_sum += amt
+    # ===== PAID rows (filtered, one page) =====
+    try:
+        page = max(1, int(request.args.get("page", 1)))
+    except ValueError:
+        page = 1
+    try:
+        page_size = min(PAID_PAGE_SIZE_MAX, max(1, int(request.args.get("page_size", PAID_PAGE_SIZE))))
+    except ValueError:
+        page_size = PAID_PAGE_SIZE
+
+    # Full filter as stage 0, then $sort straight after it, so the
+    # (type_norm, payment_date, omc, paid_by, amount) index drives both; the $facet then
+    # cuts the page and totals the whole filtered set (count + sum for the pager / chip)
+    paid = next(tax_ro.aggregate([
+        {"$match": paid_query},
+        {"$sort": {"payment_date": -1}},
+        {"$facet": {
+            "rows": [
+                {"$skip": (page - 1) * page_size},
+                {"$limit": page_size},
+                {"$project": {
+                    "_id": 0, "amount": 1, "payment_date": 1, "reference": 1,
+                    "paid_by": 1, "omc": 1, "order_id": 1
+                }},
+            ],
+            "meta": [{"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "total": {"$sum": {"$convert": {"input": "$amount", "to": "double", "onError": 0, "onNull": 0}}},
+            }}],
+        }},
+    ]), {})
+    meta = (paid.get("meta") or [{}])[0]
+    total_paid_count = meta.get("count", 0)
+    total_paid_sum = _f(meta.get("total"), 0.0)
+    total_pages = max(1, -(-total_paid_count // page_size))
+
+    # ===== CARDS + Trend (ALL S-Tax): one $facet over the type-matched records, cached =====
+    res = {}
+    cached = stax_cache.cards_trend.get("cards_trend")
+    if not (cached and time.monotonic() - cached[0] < CARDS_TREND_TTL):
+        cached = None
+        res = next(tax_col.aggregate([  # primary: this copy is served for the whole TTL
+            {"$match": _paid_type_query()},
+            {"$facet": {
+                # totals per OMC (ALL S-Tax, not filtered)
+                "cards": [
+                    {"$group": {"_id": "$omc", "total": {"$sum": "$amount"}}},
+                    {"$sort": {"total": -1}},
+                ],
+                # per calendar month (ALL S-Tax); string dates are backfilled to Date by migrate.py
+                "trend": [
+                    {"$match": {"payment_date": {"$type": "date"}}},
+                    {"$group": {"_id": {"$month": "$payment_date"}, "total": {"$sum": "$amount"}}},
+                ],
+            }},
+        ]), {})
+
+    f = _f
+    paid_rows = []
+    append = paid_rows.append
+    for t in paid.get("rows", []):
+        amt = f(t.get("amount"), 0.0)
+        # payment_date is a BSON Date (migrate.py backfills legacy strings); anything else is shown as-is
         pd = t.get("payment_date")
-        if isinstance(pd, str):
-            try:
-                pd_dt = datetime.strptime(pd, "%Y-%m-%d")
-            except Exception:
-                pd_dt = None
-        else:
-            pd_dt = pd if isinstance(pd, datetime) else None
 
-        paid_rows.append({
+        append({
             "omc": t.get("omc", "—"),
             "order_id": t.get("order_id", "—"),
             "amount": amt,
-            "amount_fmt": _fmt(amt),
+            "amount_fmt": fmt(amt),
             "payment_date": pd,
-            "payment_date_str": pd_dt.strftime("%Y-%m-%d") if pd_dt else str(pd or "—"),
+            "payment_date_str": pd.strftime("%Y-%m-%d") if type(pd) is datetime else str(pd or "—"),
             "reference": t.get("reference", "—"),
             "paid_by": t.get("paid_by", "—"),
         })
 
-    # ===== CARDS: totals per OMC (ALL S-Tax, not filtered) =====
-    pipeline_cards = [
-        {"$match": _paid_type_query()},
-        {"$group": {"_id": "$omc", "total": {"$sum": "$amount"}}},
-        {"$sort": {"total": -1}},
-    ]
-    omc_cards = []
-    for d in tax_col.aggregate(pipeline_cards):
-        name = d.get("_id") or "—"
-        total = float(d.get("total") or 0.0)
-        if total > 0:
-            omc_cards.append({"omc": name, "total": total, "total_fmt": _fmt(total)})
-
-    # ===== Trend (all S-Tax) =====
-    trend = _month_buckets()
-    for row in tax_col.find(_paid_type_query(), {"amount": 1, "payment_date": 1}):
-        dtp = row.get("payment_date")
-        try:
-            if isinstance(dtp, str):
-                try:
-                    dtp = datetime.strptime(dtp, "%Y-%m-%d")
-                except Exception:
-                    continue
-            if not isinstance(dtp, datetime):
-                continue
-            trend[calendar.month_name[dtp.month]] += _f(row.get("amount"), 0.0)
-        except Exception:
-            continue
+    if cached:
+        _, omc_cards, trend = cached
+    else:
+        # ===== CARDS: totals per OMC (ALL S-Tax, not filtered) =====
+        omc_cards = []
+        for d in res.get("cards", []):
+            name = d.get("_id") or "—"
+            total = float(d.get("total") or 0.0)
+            if total > 0:
+                omc_cards.append({"omc": name, "total": total, "total_fmt": _fmt(total)})
+
+        # ===== Trend (all S-Tax) =====
+        trend = _month_buckets()
+        for d in res.get("trend", []):
+            trend[calendar.month_name[d["_id"]]] = _f(d.get("total"), 0.0)
+        stax_cache.cards_trend["cards_trend"] = (time.monotonic(), omc_cards, trend)
+
+    filters = {
+        "omc": omc_f, "paid_by": paid_by_f,
+        "date_from": date_from_s, "date_to": date_to_s,
+        "amount_min": amt_min_s, "amount_max": amt_max_s,
+    }
+    # pager links keep the active filters (and a non-default page size)
+    qs = {k: v for k, v in filters.items() if v}
+    if page_size != PAID_PAGE_SIZE:
+        qs["page_size"] = page_size
+    page_qs = urlencode(qs) + "&" if qs else ""
 
     return render_template(
         "partials/tax_dashboard.html",
@@ -229,12 +361,12 @@ def tax_dashboard():
         total_unpaid_sum=_fmt(total_unpaid_sum),
         paid_rows=paid_rows,
         total_paid_sum=_fmt(total_paid_sum),
+        total_paid_count=total_paid_count,
+        current_page=page,
+        total_pages=total_pages,
+        page_qs=page_qs,
         omc_cards=omc_cards,
-        filters={
-            "omc": omc_f, "paid_by": paid_by_f,
-            "date_from": date_from_s, "date_to": date_to_s,
-            "amount_min": amt_min_s, "amount_max": amt_max_s,
-        },
+        filters=filters,
         trend_data=trend
     )
 
@@ -261,30 +393,10 @@ def pay_stax():
             oid = ObjectId(order_oid)
         except (errors.InvalidId, Exception):
             return jsonify({"status": "error", "message": "Invalid order id"}), 400
-
-        order = orders_col.find_one({"_id": oid})
-        if not order:
-            return jsonify({"status": "error", "message": "Order not found"}), 404
-
-        # S-Tax eligible if explicit type s_tax/combo OR has s_tax value
-        is_stax_type    = str(order.get("order_type", "")).lower() in {"s_tax", "combo"}
-        has_stax_value  = _stax_per_l(order) > 0
-        if not (is_stax_type or has_stax_value):
-            return jsonify({"status": "error", "message": "Order has no S-Tax to pay"}), 400
-
-        due = _order_stax_due(order)  # s_tax × qty
+        # request-only checks first, so bad input costs no round trips
         if amount <= 0:
             return jsonify({"status": "error", "message": "Amount must be greater than 0"}), 400
 
-        already_paid_before = _paid_sum_for_order(oid)
-        remaining_before = max(0.0, round(due - already_paid_before, 2))
-        if remaining_before <= 0:
-            # Already fully paid; keep idempotent behavior
-            return jsonify({"status": "error", "message": "S-Tax already fully paid"}), 400
-
-        if amount > remaining_before:
-            return jsonify({"status": "error", "message": f"Amount exceeds remaining balance (GH₵ {_fmt(remaining_before)})"}), 400
-
         # payment date
         pay_dt = datetime.utcnow()
         if payment_date_str:
@@ -293,43 +405,81 @@ def pay_stax():
             except ValueError:
                 return jsonify({"status": "error", "message": "Invalid payment date"}), 400
 
-        # insert payment
-        tax_col.insert_one({
-            "type": "S-Tax",
-            "amount": round(float(amount), 2),
-            "payment_date": pay_dt,
-            "reference": reference or None,
-            "paid_by": paid_by or None,
-            "omc": order.get("omc"),
-            "order_id": order.get("order_id"),
-            "order_oid": oid,
-            "submitted_at": datetime.utcnow()
+        order = orders_col.find_one({"_id": oid}, {
+            "order_type": 1, "stax_per_l": 1, "s_tax": 1, "s-tax": 1, "quantity": 1, "omc": 1, "order_id": 1,
+            "s_tax_reference": 1, "s_tax_paid_by": 1,
         })
+        if not order:
+            return jsonify({"status": "error", "message": "Order not found"}), 404
 
-        # recompute totals AFTER insert
-        already_paid_after = _paid_sum_for_order(oid)
-        remaining_after = max(0.0, round(due - already_paid_after, 2))
+        # S-Tax eligible if explicit type s_tax/combo OR has s_tax value
+        is_stax_type    = str(order.get("order_type", "")).lower() in {"s_tax", "combo"}
+        has_stax_value  = _order_stax_per_l(order) > 0
+        if not (is_stax_type or has_stax_value):
+            return jsonify({"status": "error", "message": "Order has no S-Tax to pay"}), 400
 
-        # set flags only when fully paid
-        update_doc = {
-            "s_tax_paid_amount": round(float(already_paid_after), 2),
-            "s_tax_paid_at": pay_dt,
-            "s_tax_reference": reference or order.get("s_tax_reference"),  # keep last/any
-            "s_tax_paid_by": paid_by or order.get("s_tax_paid_by"),
-        }
-        if remaining_after <= 0:
-            update_doc.update({
-                "s_tax_payment": "paid",
-                "s-tax-payment": "paid",
-            })
-        else:
-            # ensure flags are not incorrectly set to paid
-            update_doc.update({
-                "s_tax_payment": "partial",
-                "s-tax-payment": "partial",
-            })
-
-        orders_col.update_one({"_id": oid}, {"$set": update_doc})
+        due = _order_stax_due(order)  # s_tax × qty
+        amount = round(float(amount), 2)
+
+        # Read paid total, insert the payment and update the order flags atomically.
+        # Concurrent payments on one order both write the order doc, so one hits a write
+        # conflict and with_transaction retries it against the new paid total.
+        def _write(s):
+            already_paid_before = _paid_sum_for_order(oid, session=s)
+            remaining_before = max(0.0, round(due - already_paid_before, 2))
+            if remaining_before <= 0:
+                # Already fully paid; keep idempotent behavior
+                return None, "S-Tax already fully paid"
+            if amount > remaining_before:
+                return None, f"Amount exceeds remaining balance (GH₵ {_fmt(remaining_before)})"
+
+            # insert payment
+            tax_col.insert_one({
+                "type": "S-Tax",
+                "type_norm": "s_tax",
+                "amount": amount,
+                "payment_date": pay_dt,
+                "reference": reference or None,
+                "paid_by": paid_by or None,
+                "omc": order.get("omc"),
+                "order_id": order.get("order_id"),
+                "order_oid": oid,
+                "submitted_at": datetime.utcnow()
+            }, session=s)
+
+            # totals AFTER insert (no second $group round trip)
+            already_paid_after = already_paid_before + amount
+            remaining_after = max(0.0, round(due - already_paid_after, 2))
+
+            # set flags only when fully paid
+            update_doc = {
+                "stax_unpaid": remaining_after > 0,
+                "s_tax_paid_amount": round(float(already_paid_after), 2),
+                "s_tax_paid_at": pay_dt,
+                "s_tax_reference": reference or order.get("s_tax_reference"),  # keep last/any
+                "s_tax_paid_by": paid_by or order.get("s_tax_paid_by"),
+            }
+            if remaining_after <= 0:
+                update_doc.update({
+                    "s_tax_payment": "paid",
+                    "s-tax-payment": "paid",
+                })
+            else:
+                # ensure flags are not incorrectly set to paid
+                update_doc.update({
+                    "s_tax_payment": "partial",
+                    "s-tax-payment": "partial",
+                })
+
+            orders_col.update_one({"_id": oid}, {"$set": update_doc}, session=s)
+            return (already_paid_after, remaining_after), None
+
+        with db.client.start_session() as s:
+            totals, error = s.with_transaction(_write)
+        if error:
+            return jsonify({"status": "error", "message": error}), 400
+        stax_cache.invalidate()
+        already_paid_after, remaining_after = totals
 
         return jsonify({
             "status": "success",
@@ -361,8 +511,10 @@ def add_tax():
             except ValueError:
                 return jsonify({"status": "error", "message": "Invalid payment date"}), 400
 
+        type_norm = _type_norm(tax_type)
         new_tax = {
-            "type": tax_type,
+            "type": "S-Tax" if type_norm == "s_tax" else tax_type,  # one display spelling, as pay_stax writes
+            "type_norm": type_norm,
             "amount": round(amount, 2),
             "payment_date": pay_dt,
             "reference": reference,
@@ -370,6 +522,7 @@ def add_tax():
             "submitted_at": datetime.utcnow()
         }
         tax_col.insert_one(new_tax)
+        stax_cache.invalidate()
         return jsonify({"status": "success"})
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -403,23 +556,18 @@ def export_tax_pdf():
     except ValueError:
         pass
 
-    rows = list(tax_col.find(q).sort("payment_date", -1))
+    # Streamed straight into the PDF loop (running total kept there), never materialized
+    rows = tax_ro.find(q, {
+        "_id": 0, "payment_date": 1, "omc": 1, "order_id": 1, "paid_by": 1, "reference": 1, "amount": 1
+    }).sort("payment_date", -1).batch_size(500)
 
     try:
         from reportlab.lib.pagesizes import A4, landscape
         from reportlab.pdfgen import canvas
         from reportlab.lib.units import mm
-        from reportlab.lib.utils import ImageReader
         from reportlab.pdfbase.pdfmetrics import stringWidth
 
-        # Try to fetch logo (AVIF may fail; ignore if so)
-        logo_bytes = None
-        try:
-            resp = requests.get("https://res.cloudinary.com/dl2ipzxyk/image/upload/v1751107241/logo_ijmteg.avif", timeout=6)
-            if resp.ok:
-                logo_bytes = resp.content
-        except Exception:
-            logo_bytes = None
+        logo = _logo_reader()
 
         buf = BytesIO()
         W, H = landscape(A4)
@@ -442,14 +590,13 @@ def export_tax_pdf():
         def draw_header(c, page_num):
             y = H - top_margin
             x = left_margin
-            if logo_bytes:
+            if logo:
                 try:
-                    img = ImageReader(BytesIO(logo_bytes))
                     logo_h = 10*mm
-                    iw, ih = img.getSize()
+                    iw, ih = logo.getSize()
                     ratio = logo_h / ih
                     logo_w = iw * ratio
-                    c.drawImage(img, x, y - logo_h, width=logo_w, height=logo_h, mask='auto')
+                    c.drawImage(logo, x, y - logo_h, width=logo_w, height=logo_h, mask='auto')
                     x += logo_w + 6
                 except Exception:
                     pass
@@ -474,43 +621,46 @@ def export_tax_pdf():
             c.line(left_margin, header_y - 12, left_margin + table_width, header_y - 12)
             return header_y - 14
 
-        def draw_table(c):
+        def start_rows(c):
+            # header leaves Helvetica-Bold / 0.6pt lines; rows use Helvetica 9 / 0.3pt, set once per page
             y = draw_header(c, draw_table.page)
             c.setFont("Helvetica", 9)
+            c.setLineWidth(0.3)
+            return y
+
+        def draw_table(c):
+            y = start_rows(c)
             line_height = 10
             x_cols = [left_margin]
             for _, w in col_defs:
                 x_cols.append(x_cols[-1] + w)
+            max_ws = [w - 4 for _, w in col_defs]
 
             total_amt = 0.0
             for r in rows:
                 if y < bottom_margin + 20*mm:
                     c.showPage()
                     draw_table.page += 1
-                    y = draw_header(c, draw_table.page)
-                    c.setFont("Helvetica", 9)
+                    y = start_rows(c)
 
+                amt = _f(r.get("amount"), 0.0)
                 pd = r.get("payment_date")
-                date_str = pd.strftime("%Y-%m-%d") if isinstance(pd, datetime) else str(pd or "—")
+                date_str = pd.strftime("%Y-%m-%d") if type(pd) is datetime else str(pd or "—")
                 vals = [
                     date_str,
                     r.get("omc", "—"),
                     r.get("order_id", "—"),
                     r.get("paid_by", "—"),
                     r.get("reference", "—"),
-                    _fmt(_f(r.get("amount"), 0.0)),
+                    _fmt(amt),
                 ]
                 for i, val in enumerate(vals):
-                    txt = str(val)
-                    maxw = col_defs[i][1] - 4
-                    while stringWidth(txt, "Helvetica", 9) > maxw and len(txt) > 3:
-                        txt = txt[:-4] + "…"
+                    txt = _fit_text(str(val), max_ws[i], stringWidth)
                     x = x_cols[i] + 2
                     c.drawString(x, y, txt)
-                c.setLineWidth(0.3)
                 c.line(left_margin, y - 2, left_margin + table_width, y - 2)
                 y -= line_height
-                total_amt += _f(r.get("amount"), 0.0)
+                total_amt += amt
 
             c.setFont("Helvetica-Bold", 9)
             c.line(left_margin, y - 2, left_margin + table_width, y - 2)